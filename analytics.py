@@ -0,0 +1,179 @@
+import argparse
+import contextlib
+import json
+import time
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the reports, the ordering system itself runs without it
+    np = None
+
+from cakeorderingsystem import LockedOrderBST, OrderStore
+
+COLUMNS = (("order_id", "int64"), ("cake", "int32"), ("weight", "float64"), ("quantity", "int64"),
+           ("unit_price", "float64"), ("live", "bool"))
+
+
+class OrderAnalytics:
+    # revenue and sales reports over every cake item of the orders in an OrderBST. The cake items are kept in
+    # columns (NumPy arrays, one row per cake item) so the reports are computed with whole-array operations
+    # instead of a tree walk. The tree tells this object which orders changed and only the rows of those orders
+    # are rewritten when the next report is asked for
+    def __init__(self, bst):
+        if np is None:
+            raise RuntimeError("The order analytics need numpy (pip install numpy).")
+        self.bst = bst
+        self.cake_codes = []  # column "cake" holds the position of the cake code in this list
+        self.cake_positions = {}  # cake code -> position in cake_codes
+        self.columns = {name: np.zeros(1024, dtype) for name, dtype in COLUMNS}
+        self.row_count = 0  # rows in use, the columns have spare room after them
+        self.dead_rows = 0  # rows of changed or deleted orders that are not live any more
+        self.rows_by_order = {}  # order ID -> (first row, number of rows), the rows of an order are together
+        self.changed = {}  # order ID -> the order last added/changed/removed with that ID, since the last refresh
+        with self._locked():
+            self._append_orders(list(bst.iter_orders()))
+            bst.analytics = self
+
+    def _locked(self):
+        # keep writers out of a LockedOrderBST while its orders are read, nothing to lock for a plain OrderBST
+        if isinstance(self.bst, LockedOrderBST):
+            return self.bst.lock.write()  # the columns are rewritten as well, so it has to be exclusive
+        return contextlib.nullcontext()
+
+    def order_changed(self, order):
+        # called by the tree whenever an order is added, removed or its cake items change
+        self.changed[order.order_id] = order
+
+    def refresh(self):
+        # rewrite the rows of the orders changed since the last refresh
+        if not self.changed:
+            return
+        with self._locked():
+            changed, self.changed = self.changed, {}
+            live = self.columns["live"]
+            orders = []
+            for order_id, order in changed.items():
+                rows = self.rows_by_order.pop(order_id, None)
+                if rows is not None:  # the old rows of the order are not counted any more
+                    live[rows[0]:rows[0] + rows[1]] = False
+                    self.dead_rows += rows[1]
+                if order.bst is self.bst and order.order_id == order_id:  # still in the tree
+                    orders.append(order)
+            self._append_orders(orders)
+            if self.dead_rows > 1024 and self.dead_rows > self.row_count - self.dead_rows:
+                self._compact()
+
+    def _append_orders(self, orders):
+        order_ids, cakes, weights, quantities, unit_prices = [], [], [], [], []
+        first_row = self.row_count
+        for order in orders:
+            self.rows_by_order[order.order_id] = (first_row + len(order_ids), len(order.cake_items))
+            for cake, weight, quantity in order.cake_items:
+                position = self.cake_positions.get(cake.code)
+                if position is None:
+                    position = self.cake_positions[cake.code] = len(self.cake_codes)
+                    self.cake_codes.append(cake.code)
+                order_ids.append(order.order_id)
+                cakes.append(position)
+                weights.append(weight)
+                quantities.append(quantity)
+                unit_prices.append(cake.unit_price)
+        new_rows = len(order_ids)
+        self._reserve(first_row + new_rows)
+        end = first_row + new_rows
+        for name, values in (("order_id", order_ids), ("cake", cakes), ("weight", weights),
+                             ("quantity", quantities), ("unit_price", unit_prices)):
+            self.columns[name][first_row:end] = values
+        self.columns["live"][first_row:end] = True
+        self.row_count = end
+
+    def _reserve(self, rows):
+        # grow the columns (doubling) so that they have room for rows rows
+        capacity = len(self.columns["live"])
+        if rows <= capacity:
+            return
+        while capacity < rows:
+            capacity *= 2
+        for name, column in self.columns.items():
+            grown = np.zeros(capacity, column.dtype)
+            grown[:self.row_count] = column[:self.row_count]
+            self.columns[name] = grown
+
+    def _compact(self):
+        # drop the dead rows, the rows of each order stay together and in the same order
+        keep = self.columns["live"][:self.row_count]
+        for name, column in self.columns.items():
+            kept = column[:self.row_count][keep]
+            column[:len(kept)] = kept
+        self.row_count -= self.dead_rows
+        self.dead_rows = 0
+        order_ids, first_rows, counts = np.unique(self.columns["order_id"][:self.row_count], return_index=True,
+                                                  return_counts=True)
+        self.rows_by_order = dict(zip(order_ids.tolist(), zip(first_rows.tolist(), counts.tolist())))
+
+    def _live_columns(self, *names):
+        # copies of the live rows of some columns, up to date with the tree
+        with self._locked():
+            self.refresh()
+            live = self.columns["live"][:self.row_count]
+            return [self.columns[name][:self.row_count][live] for name in names]
+
+    def total_revenue(self):
+        weight, quantity, unit_price = self._live_columns("weight", "quantity", "unit_price")
+        return float(np.dot(unit_price * weight, quantity))
+
+    def average_order_value(self):
+        revenue = self.total_revenue()  # refreshes rows_by_order as well
+        return revenue / len(self.rows_by_order) if self.rows_by_order else 0.0
+
+    def sales_by_cake(self):
+        # cake code -> cakes sold, kg sold and revenue, for every cake code that has been ordered
+        cake, weight, quantity, unit_price = self._live_columns("cake", "weight", "quantity", "unit_price")
+        kinds = len(self.cake_codes)
+        sold = np.bincount(cake, weights=quantity, minlength=kinds)
+        kilograms = np.bincount(cake, weights=weight * quantity, minlength=kinds)
+        revenue = np.bincount(cake, weights=unit_price * weight * quantity, minlength=kinds)
+        return {code: {"quantity": int(sold[i]), "kilograms": float(kilograms[i]), "revenue": float(revenue[i])}
+                for i, code in enumerate(self.cake_codes) if sold[i]}
+
+    def weight_distribution(self):
+        # cake weight (kg) -> number of cakes sold with that weight
+        weight, quantity = self._live_columns("weight", "quantity")
+        weights, positions = np.unique(weight, return_inverse=True)
+        sold = np.bincount(positions, weights=quantity, minlength=len(weights))
+        return {float(w): int(count) for w, count in zip(weights, sold)}
+
+    def report(self):
+        revenue = self.total_revenue()
+        orders = len(self.rows_by_order)
+        return {"orders": orders, "cake_items": self.row_count - self.dead_rows, "total_revenue": revenue,
+                "average_order_value": revenue / orders if orders else 0.0, "sales_by_cake": self.sales_by_cake(),
+                "weight_distribution": self.weight_distribution()}
+
+    def close(self):
+        # stop following the changes of the tree
+        if self.bst.analytics is self:
+            self.bst.analytics = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Revenue and sales report of the orders kept on disk")
+    parser.add_argument("--data-dir", required=True, help="directory the orders are kept in")
+    args = parser.parse_args(argv)
+
+    store = OrderStore(args.data_dir)
+    try:
+        bst = store.load()
+        start = time.perf_counter()
+        analytics = OrderAnalytics(bst)
+        loaded = time.perf_counter() - start
+        start = time.perf_counter()
+        report = analytics.report()
+        print(json.dumps(report, indent=2))
+        print(f"Cake items loaded in {loaded:.3f} s, report computed in {time.perf_counter() - start:.3f} s")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from cakeorderingsystem import (Customer, LineItem, LockedOrderBST, ModifyOrderRequest, Order, OrderBST, OrderService,
+                                OrderStore, PlaceOrderRequest, SequentialIdAllocator, ShuffledIdAllocator,
+                                SnowflakeIdAllocator)
+
+DISTRIBUTIONS = ("random", "sorted", "zigzag")
+# cold-start budgets (ms, on top of starting the interpreter itself): importing the module for reuse, and the
+# command line up to parsing its arguments
+STARTUP_BUDGET_MS = {"import": 50, "cli_help": 80}
+REPOSITORY_DIR = os.path.dirname(os.path.abspath(__file__))  # the startup commands run here, from any directory
+STARTUP_COMMANDS = {
+    "interpreter": [sys.executable, "-c", "pass"],
+    "import": [sys.executable, "-c", "import cakeorderingsystem"],
+    "cli_help": [sys.executable, "cakeorderingsystem.py", "--help"],
+}
+
+
+def order_ids(distribution, n, rng):
+    # the order IDs 1..n in the order they are inserted
+    if distribution == "random":
+        ids = list(range(1, n + 1))
+        rng.shuffle(ids)
+        return ids
+    if distribution == "sorted":  # worst case of the plain BST, every insert goes to the right
+        return list(range(1, n + 1))
+    # zigzag: 1, n, 2, n - 1, ... another input that makes the plain BST one long path
+    ids = []
+    low, high = 1, n
+    while low <= high:
+        ids.append(low)
+        if low != high:
+            ids.append(high)
+        low += 1
+        high -= 1
+    return ids
+
+
+def make_orders(ids, cakes):
+    orders = []
+    for order_id in ids:
+        order = Order(Customer("Benchmark Customer", "1 Benchmark Road", "0123456789"))
+        order.set_order_id(order_id)
+        order.add_cake(cakes[order_id % len(cakes)], 1.0, 1 + order_id % 3)
+        orders.append(order)
+    return orders
+
+
+def summarise(latencies_ns):
+    # throughput and latency percentiles of one operation
+    latencies_ns.sort()
+    count = len(latencies_ns)
+    total = sum(latencies_ns)
+    return {
+        "ops": count,
+        "ops_per_sec": round(count / (total / 1e9), 1) if total else None,
+        "p50_us": round(latencies_ns[count // 2] / 1000, 3),
+        "p99_us": round(latencies_ns[min(count - 1, count * 99 // 100)] / 1000, 3),
+    }
+
+
+def timed(operation, arguments):
+    # run operation once for each argument and return the latency of each call in nanoseconds
+    clock = time.perf_counter_ns
+    latencies = []
+    for argument in arguments:
+        start = clock()
+        operation(argument)
+        latencies.append(clock() - start)
+    return latencies
+
+
+def two_child_ids(bst, limit):
+    # order IDs of nodes that have two children, deleting them goes through the successor path
+    ids = []
+    stack = [bst.root] if bst.root is not None else []
+    while stack and len(ids) < limit:
+        node = stack.pop()
+        if node.left is not None and node.right is not None:
+            ids.append(node.order.order_id)
+        stack.extend(child for child in (node.left, node.right) if child is not None)
+    return ids
+
+
+def bench_tree(backend, distribution, n, rng, cakes, samples, measure_memory):
+    ids = order_ids(distribution, n, rng)
+    orders = make_orders(ids, cakes)
+    bst = OrderBST(backend=backend)
+    results = {"insert_order": summarise(timed(bst.insert_order, orders))}
+    results["height"] = bst.height()
+    results["rotations"] = bst.rotations
+
+    lookups = [rng.randint(1, n) for _ in range(samples)]
+    results["search_order"] = summarise(timed(bst.search_order, lookups))
+    results["search_order_missing"] = summarise(timed(bst.search_order, [n + 1 + i for i in range(samples)]))
+
+    start = time.perf_counter_ns()
+    for _ in bst.iter_orders():
+        pass
+    traversal_ns = time.perf_counter_ns() - start
+    results["traversal"] = {"orders": n, "ms": round(traversal_ns / 1e6, 3),
+                            "orders_per_sec": round(n / (traversal_ns / 1e9), 1) if traversal_ns else None}
+
+    picked = rng.sample(orders, min(samples, n))
+    results["calculate_total_amount"] = summarise(timed(Order.calculate_total_amount, picked))
+
+    to_delete = two_child_ids(bst, samples)
+    results["delete_order_two_children"] = summarise(timed(bst.delete_order, to_delete)) if to_delete else None
+    deleted = set(to_delete)
+    remaining = [order_id for order_id in rng.sample(range(1, n + 1), min(samples, n)) if order_id not in deleted]
+    results["delete_order"] = summarise(timed(bst.delete_order, remaining)) if remaining else None
+
+    if measure_memory:  # build the tree again under tracemalloc, it slows the code down so it is not timed
+        orders = None
+        bst = None
+        tracemalloc.start()
+        memory_bst = OrderBST(backend=backend)
+        for order in make_orders(ids, cakes):
+            memory_bst.insert_order(order)
+        results["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return results
+
+
+def bench_order_ids(n, samples, cakes):
+    # generate_order_id with each allocator, on a system that already holds n orders with IDs from that allocator
+    results = {}
+    allocators = {
+        "sequential": lambda: SequentialIdAllocator(),
+        "shuffled": lambda: ShuffledIdAllocator(1, max(10 * n, 10000), random.Random(1)),
+        "snowflake": lambda: SnowflakeIdAllocator(),
+    }
+    for name, allocator in allocators.items():
+        service = OrderService(id_allocator=allocator())
+        service.bst.bulk_load(make_orders([service.generate_order_id() for _ in range(n)], cakes))
+        results[name] = summarise(timed(lambda _: service.generate_order_id(), range(samples)))
+    return results
+
+
+def bench_workflow(n, samples):
+    # end-to-end place, modify and delete through OrderService (checks, customer registry, indexes and tree) on a
+    # system that already holds n orders
+    service = OrderService(id_allocator=SequentialIdAllocator())
+    orders = make_orders(range(1, n + 1), list(service.catalog))
+    for order in orders:
+        service.id_allocator.reserve(order.order_id)
+    service.bst.bulk_load(orders)
+    places = [PlaceOrderRequest(f"Workflow Customer {i}", "1 Workflow Road", f"01{i:08d}",
+                                [LineItem(str(1 + i % len(service.catalog)), 1.0, 1)]) for i in range(samples)]
+    results = {"create_order": summarise(timed(service.create_order, places))}
+    placed_ids = list(range(n + 1, n + 1 + samples))  # the sequential allocator hands out the IDs after n
+    modifies = [ModifyOrderRequest(order_id, address="2 Workflow Road", items={0: LineItem("1", 2.0, 2)})
+                for order_id in placed_ids]
+    results["update_order"] = summarise(timed(service.update_order, modifies))
+    results["remove_order"] = summarise(timed(service.remove_order, placed_ids))
+    return results
+
+
+def bench_locking(n, readers, writer_counts, seconds, cakes):
+    # reads/sec of reader threads searching a LockedOrderBST of n orders while writer threads insert and delete
+    # orders (IDs above n), for each number of writers
+    results = {}
+    for writers in writer_counts:
+        bst = LockedOrderBST(backend="avl")
+        bst.bulk_load(make_orders(range(1, n + 1), cakes))
+        stop = threading.Event()
+        reads = [0] * readers
+        writes = [0] * writers
+
+        def read(number):
+            rng = random.Random(number)
+            while not stop.is_set():
+                for _ in range(100):
+                    bst.search_order(rng.randint(1, n))
+                reads[number] += 100
+
+        def write(number):
+            order_id = n + 1 + number
+            while not stop.is_set():
+                order = make_orders([order_id], cakes)[0]
+                bst.insert_order(order)
+                bst.delete_order(order_id)
+                writes[number] += 2
+
+        threads = [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+        threads += [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        results[str(writers)] = {"reads_per_sec": round(sum(reads) / seconds, 1),
+                                 "writes_per_sec": round(sum(writes) / seconds, 1)}
+        print(f"{readers} readers {writers:>3} writers  {results[str(writers)]['reads_per_sec']:>10} reads/s  "
+              f"{results[str(writers)]['writes_per_sec']:>10} writes/s")
+    return results
+
+
+def bench_startup(runs):
+    # median wall time (ms) of each startup command in a new process, the first run only warms up the caches
+    results = {}
+    for name, command in STARTUP_COMMANDS.items():
+        times = []
+        for _ in range(runs + 1):
+            start = time.perf_counter()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL, cwd=REPOSITORY_DIR)
+            times.append((time.perf_counter() - start) * 1000)
+        times = sorted(times[1:])
+        results[name] = round(times[len(times) // 2], 1)
+    for name, budget in STARTUP_BUDGET_MS.items():
+        extra = round(results[name] - results["interpreter"], 1)
+        status = "ok" if extra <= budget else "OVER BUDGET"
+        print(f"{name:<9} {results[name]:>7} ms  ({extra:>6} ms over the interpreter, budget {budget} ms)  {status}")
+    return results
+
+
+def bench_reload(n, runs, log_operations, cakes):
+    # startup time of an OrderStore holding n orders: a snapshot of n orders plus log_operations logged
+    # modifications, loaded runs times (median). "service_seconds" includes building the OrderService on top
+    directory = tempfile.mkdtemp(prefix="cake-reload-")
+    try:
+        store = OrderStore(directory, snapshot_every=log_operations + 1)
+        store.load()
+        orders = make_orders(range(1, n + 1), cakes)
+        store.bst.bulk_load(orders)
+        store.snapshot()
+        for order in orders[:log_operations]:
+            store.log_modify(order)
+        store.close()
+        orders = None
+        load_times = []
+        service_times = []
+        for _ in range(runs):
+            store = OrderStore(directory)
+            start = time.perf_counter()
+            service = OrderService(id_allocator=SequentialIdAllocator(), store=store)
+            service_times.append(time.perf_counter() - start)
+            load_times.append(store.last_load_seconds)
+            if len(service.bst) != n:
+                raise RuntimeError(f"Reloaded {len(service.bst)} orders instead of {n}.")
+            service.close()
+            service = None
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    load_times.sort()
+    service_times.sort()
+    results = {"n": n, "log_operations": log_operations, "runs": runs,
+               "load_seconds": round(load_times[runs // 2], 3),
+               "service_seconds": round(service_times[runs // 2], 3),
+               "orders_per_sec": round(n / load_times[runs // 2], 1)}
+    print(f"reload {n:>8} orders (+{log_operations} logged)  load {results['load_seconds']:>7} s  "
+          f"service {results['service_seconds']:>7} s  {results['orders_per_sec']:>10} orders/s")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_report):
+    # print the throughput change of every operation against an earlier result file
+    with open(old_path, encoding="utf-8") as old_file:
+        old_report = json.load(old_file)
+    old_results = {(r["backend"], r["distribution"], r["n"]): r for r in old_report["results"]}
+    print(f"\nCompared with {old_path} (commit {old_report.get('commit')}):")
+    for result in new_report["results"]:
+        old = old_results.get((result["backend"], result["distribution"], result["n"]))
+        if old is None or result.get("skipped") or old.get("skipped"):
+            continue
+        for operation, stats in result.items():
+            old_stats = old.get(operation)
+            if isinstance(stats, dict) and isinstance(old_stats, dict) and stats.get("ops_per_sec") \
+                    and old_stats.get("ops_per_sec"):
+                change = (stats["ops_per_sec"] / old_stats["ops_per_sec"] - 1) * 100
+                print(f"{result['backend']:>4} {result['distribution']:>7} {result['n']:>8} {operation:<26} "
+                      f"{change:+7.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the OrderBST operations and the order workflow")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="numbers of orders (e.g. 1000 10000 100000 1000000)")
+    parser.add_argument("--backends", nargs="+", choices=OrderBST.backends, default=list(OrderBST.backends))
+    parser.add_argument("--distributions", nargs="+", choices=DISTRIBUTIONS, default=list(DISTRIBUTIONS))
+    parser.add_argument("--samples", type=int, default=1000, help="number of timed calls per operation")
+    parser.add_argument("--max-degenerate-size", type=int, default=10000,
+                        help="skip the plain BST with sorted/zigzag IDs above this size (it takes O(n^2))")
+    parser.add_argument("--no-memory", action="store_true", help="do not measure the peak memory")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="benchmark.json", help="JSON file to save the results to")
+    parser.add_argument("--compare", metavar="OLD_JSON", help="compare the results with an earlier result file")
+    parser.add_argument("--startup", action="store_true",
+                        help="only measure the cold-start time of the import and the command line")
+    parser.add_argument("--startup-runs", type=int, default=9, help="runs of each startup command")
+    parser.add_argument("--locking", action="store_true",
+                        help="only measure the reads/sec of a LockedOrderBST against the number of writer threads")
+    parser.add_argument("--readers", type=int, default=4, help="reader threads of the locking benchmark")
+    parser.add_argument("--writers", type=int, nargs="+", default=[0, 1, 2, 4],
+                        help="numbers of writer threads of the locking benchmark")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per locking benchmark run")
+    parser.add_argument("--reload", type=int, nargs="+", metavar="N",
+                        help="only measure the startup time of reloading N orders from the order store")
+    parser.add_argument("--reload-runs", type=int, default=3, help="reloads per size (median)")
+    parser.add_argument("--log-operations", type=int, default=1000,
+                        help="logged operations replayed on top of the snapshot in the reload benchmark")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        bench_startup(args.startup_runs)
+        return
+    if args.reload:
+        cakes = OrderService.available_cake_list()
+        report = {"commit": git_commit(), "python": platform.python_version(), "timestamp": time.time(),
+                  "reload": [bench_reload(n, args.reload_runs, args.log_operations, cakes) for n in args.reload]}
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+        print(f"Results saved to {args.output}")
+        return
+    if args.locking:
+        n = args.sizes[0]
+        report = {"commit": git_commit(), "python": platform.python_version(), "timestamp": time.time(), "n": n,
+                  "readers": args.readers,
+                  "locking": bench_locking(n, args.readers, args.writers, args.duration,
+                                           OrderService.available_cake_list())}
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+        print(f"Results saved to {args.output}")
+        return
+
+    cakes = OrderService.available_cake_list()
+    report = {"commit": git_commit(), "python": platform.python_version(), "timestamp": time.time(),
+              "seed": args.seed, "results": [], "generate_order_id": {}, "workflow": {}}
+    for n in args.sizes:
+        for backend in args.backends:
+            for distribution in args.distributions:
+                result = {"backend": backend, "distribution": distribution, "n": n}
+                if backend == "bst" and distribution != "random" and n > args.max_degenerate_size:
+                    result["skipped"] = True
+                    report["results"].append(result)
+                    continue
+                rng = random.Random(f"{args.seed}-{backend}-{distribution}-{n}")
+                result.update(bench_tree(backend, distribution, n, rng, cakes, args.samples, not args.no_memory))
+                report["results"].append(result)
+                print(f"{backend:>4} {distribution:>7} {n:>8}  height {result['height']:>6}  "
+                      f"insert {result['insert_order']['ops_per_sec']:>12} ops/s  "
+                      f"search p50 {result['search_order']['p50_us']:>8} us p99 {result['search_order']['p99_us']:>8} us")
+        report["generate_order_id"][str(n)] = bench_order_ids(n, args.samples, cakes)
+        workflow = report["workflow"][str(n)] = bench_workflow(n, args.samples)
+        print(f"workflow {n:>8}  " + "  ".join(f"{operation} p50 {stats['p50_us']:>8} us"
+                                               for operation, stats in workflow.items()))
+
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump(report, output, indent=2)
+    print(f"Results saved to {args.output}")
+    if args.compare:
+        compare(args.compare, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,139 @@
+import bisect
+import contextlib
+import csv
+import heapq
+import itertools
+import json
+import os
 import random
 import re
-from tabulate import tabulate
+import sys
+import threading
+import time
+
+CONTACT_PATTERN = re.compile(r'^0\d{9,10}$')  # contact number starts with '0' and has 10-11 digits
+AVAILABLE_WEIGHTS = (0.25, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0)  # cake weights (kg) that can be ordered
 
 
 class Cake:
+    # a cake record is shared by the catalog and every order line of that cake, so it is read-only
+    __slots__ = ("code", "flavour", "weight", "unit_price")  # no per-object __dict__, saves memory
+
     def __init__(self, code, flavour, weight, unit_price):
-        self.code = code
-        self.flavour = flavour
-        self.weight = weight
-        self.unit_price = unit_price
+        object.__setattr__(self, "code", code)
+        object.__setattr__(self, "flavour", flavour)
+        object.__setattr__(self, "weight", weight)
+        object.__setattr__(self, "unit_price", unit_price)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Cake records are read-only, create a new Cake instead.")
+
+    def __reduce__(self):
+        # pickle and copy build the cake again through __init__, not by setting the attributes one by one
+        return Cake, (self.code, self.flavour, self.weight, self.unit_price)
+
+
+class CakeCatalog:
+    # the available cakes indexed by cake code (and by flavour), built once so every lookup is O(1)
+    def __init__(self, cakes=()):
+        self.cakes_by_code = {}  # dict keeps the cakes in the order they were added
+        self.cakes_by_flavour = {}  # lower-case flavour -> list of the cakes with that flavour, flavours can repeat
+        self.version = 0  # goes up whenever the catalog changes, so cached cake tables know they are old
+        for cake in cakes:
+            self.add_cake(cake)
+
+    def add_cake(self, cake):
+        old_cake = self.cakes_by_code.get(cake.code)
+        if old_cake is not None:  # replacing a cake, only the old cake leaves its flavour list
+            flavour = old_cake.flavour.lower()
+            self.cakes_by_flavour[flavour].remove(old_cake)
+            if not self.cakes_by_flavour[flavour]:
+                del self.cakes_by_flavour[flavour]
+        self.cakes_by_code[cake.code] = cake
+        self.cakes_by_flavour.setdefault(cake.flavour.lower(), []).append(cake)
+        self.version += 1
+
+    def get_cake(self, cake_code):
+        return self.cakes_by_code.get(cake_code)  # None if the cake code does not exist
+
+    def get_cake_by_flavour(self, flavour):
+        # the first cake added with that flavour, None if there is none
+        cakes = self.cakes_by_flavour.get(flavour.lower())
+        return cakes[0] if cakes else None
+
+    def __iter__(self):
+        return iter(self.cakes_by_code.values())
+
+    def __len__(self):
+        return len(self.cakes_by_code)
 
 
 class Customer:
-    cus_id_counter = 1  # Auto-increasing variable for generating unique customer IDs
+    # Auto-increasing sequence for generating unique customer IDs, next() on it is atomic so it is thread-safe
+    id_sequence = itertools.count(1)
+    __slots__ = ("customer_id", "name", "address", "contact_number")
 
-    def __init__(self, name, address, contact):
-        self.customer_id = Customer.cus_id_counter
-        Customer.cus_id_counter += 1
+    def __init__(self, name, address, contact, customer_id=None):
+        self.customer_id = customer_id if customer_id is not None else next(Customer.id_sequence)
         self.name = name
         self.address = address
         self.contact_number = contact
 
+    @staticmethod
+    def skip_ids(customer_ids):
+        # new customers get IDs after these saved ones (e.g. the customers loaded from the store or imported)
+        next_id = max(max(customer_ids, default=0) + 1, next(Customer.id_sequence))
+        Customer.id_sequence = itertools.count(next_id)
+
+
+class CustomerRegistry:
+    # one Customer record per contact number, so the orders of a repeat customer share the same record
+    def __init__(self):
+        self.customers_by_contact = {}
+        self.lock = threading.Lock()  # orders can be placed from several threads
+
+    def get_customer(self, name, address, contact):
+        # the existing customer with this contact number, or a new customer if there is none
+        with self.lock:
+            customer = self.customers_by_contact.get(contact)
+            if customer is None:
+                customer = Customer(name, address, contact)
+                self.customers_by_contact[contact] = customer
+            return customer
+
+    def find_customer(self, contact):
+        return self.customers_by_contact.get(contact)  # None if no customer has this contact number
+
+    def add_customer(self, customer):
+        # register an existing customer record (e.g. loaded from the order store)
+        with self.lock:
+            self.customers_by_contact.setdefault(customer.contact_number, customer)
+
+    def change_contact(self, customer, new_contact):
+        # move the customer to a new contact number, False if another customer already has that number
+        with self.lock:
+            other = self.customers_by_contact.get(new_contact)
+            if other is not None and other is not customer:
+                return False
+            if self.customers_by_contact.get(customer.contact_number) is customer:
+                del self.customers_by_contact[customer.contact_number]
+            customer.contact_number = new_contact
+            self.customers_by_contact[new_contact] = customer
+            return True
+
+    def __len__(self):
+        return len(self.customers_by_contact)
+
 
 class Order:
+    __slots__ = ("order_id", "customer", "cake_items", "total_amount", "bst")
+
     def __init__(self, customer):
         self.order_id = None  # initialise the order_id to None
         self.customer = customer
         self.cake_items = []  # list to add multiple cakes into the order
+        self.total_amount = 0.0  # running total, kept up to date whenever a cake item is added or changed
+        self.bst = None  # the OrderBST holding this order, told about total changes for its revenue total
 
     def set_order_id(self, order_id):  # mutator method to set the order id (initially None)
         self.order_id = order_id
@@ -34,173 +141,1418 @@ class Order:
     def add_cake(self, cake, weight, quantity):
         # Function to add cake into the list in constructor
         self.cake_items.append((cake, weight, quantity))
+        self._change_total(cake.unit_price * weight * quantity)
+
+    def set_cake_item(self, index, cake, weight, quantity):
+        # replace one cake item and adjust the total by the difference
+        old_cake, old_weight, old_quantity = self.cake_items[index]
+        self.cake_items[index] = (cake, weight, quantity)
+        self._change_total(cake.unit_price * weight * quantity - old_cake.unit_price * old_weight * old_quantity)
 
     def calculate_total_amount(self):
+        return self.total_amount  # no need to add up the cake items again
+
+    def invalidate_total_amount(self):
+        # add up the cake items again after the cake records of the items were swapped for new prices
+        # (OrderService.change_cake)
         total_amount = 0.0
         for cake, weight, quantity in self.cake_items:
-            cake_price = cake.unit_price
-            cake_weight = weight
-            cake_quantity = quantity
-            subtotal = cake_price * cake_weight * cake_quantity
-            total_amount += subtotal
-        return total_amount
+            total_amount += cake.unit_price * weight * quantity
+        self._change_total(total_amount - self.total_amount)
+
+    def _change_total(self, difference):
+        self.total_amount += difference
+        if self.bst is not None:
+            self.bst.total_revenue += difference
+            if self.bst.analytics is not None:
+                self.bst.analytics.order_changed(self)
 
 
 class Node:
+    __slots__ = ("order", "left", "right", "height", "size")
+
     def __init__(self, order):
         self.order = order
         self.left = None
         self.right = None
+        self.height = 1  # height of the subtree rooted at this node (only maintained by the AVL backend)
+        self.size = 1  # number of nodes in the subtree rooted at this node (for rank and k-th smallest)
+
+
+class Histogram:
+    # Prometheus-style histogram: number of observed values <= each bucket bound, plus their count and sum
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)  # the last one is for values above every bound (+Inf)
+        self.count = 0
+        self.total = 0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def cumulative_counts(self):
+        return list(itertools.accumulate(self.bucket_counts))
+
+    def stats(self):
+        return {"count": self.count, "sum": self.total, "mean": self.total / self.count if self.count else 0.0,
+                "buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.cumulative_counts()))}
+
+
+class Metrics:
+    # histograms of one kind of measurement (e.g. latency) per operation
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.histograms = {}  # operation -> Histogram
+
+    def observe(self, operation, value):
+        histogram = self.histograms.get(operation)
+        if histogram is None:
+            histogram = self.histograms[operation] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def timed(self, operation, method):
+        # wrap a method so that every call records its latency in seconds
+        clock = time.perf_counter
+
+        def timed_method(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.observe(operation, clock() - start)
+        return timed_method
+
+    def stats(self):
+        return {operation: histogram.stats() for operation, histogram in self.histograms.items()}
+
+    def prometheus(self, name):
+        # the histograms in the Prometheus text format
+        lines = [f"# TYPE {name} histogram"]
+        for operation, histogram in self.histograms.items():
+            labels = f'operation="{operation}"'
+            for bound, count in zip([*map(str, self.buckets), "+Inf"], histogram.cumulative_counts()):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return lines
+
+
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)  # seconds
+VISIT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 1024, 4096)  # nodes visited by one tree operation
 
 
 class OrderBST:
-    def __init__(self):
+    backends = ("bst", "avl")  # "bst" = plain binary search tree, "avl" = self-balancing AVL tree
+
+    def __init__(self, backend="bst"):
+        if backend not in OrderBST.backends:
+            raise ValueError(f"Unknown tree backend '{backend}'. Choose from: {', '.join(OrderBST.backends)}")
         self.root = None
+        self.backend = backend
+        self.rotations = 0  # number of rotations done by the AVL backend (to verify the balancing)
+        self.total_revenue = 0.0  # total amount of all orders in the tree, updated by the orders themselves
+        # secondary indexes, key -> {order ID: order}, kept up to date on insert, modify and delete
+        self.orders_by_contact_index = {}
+        self.orders_by_name_index = {}  # key is the normalised customer name
+        self.orders_by_cake_index = {}
+        self.sorted_names = []  # distinct normalised names in sorted order, for the name prefix search
+        self.index_keys = {}  # order ID -> (contact, name, cake codes) the order is indexed under
+        self.visits = None  # Metrics of the nodes visited per operation, None until enable_metrics() is called
+        self.analytics = None  # OrderAnalytics (analytics.py) told about every order change, None if not used
+
+    def enable_metrics(self):
+        # count the nodes visited by every search, insert and delete. The operations count them as they walk the
+        # tree (inside the lock of a LockedOrderBST), insert and delete include the nodes rebalanced on the way
+        # back up by the AVL backend
+        if self.visits is None:
+            self.visits = Metrics(VISIT_BUCKETS)
+
+    def stats(self):
+        stats = {"orders": len(self), "rotations": self.rotations, "total_revenue": self.total_revenue,
+                 "height": self.root.height if self.backend == "avl" and self.root is not None else self.height()}
+        if self.visits is not None:
+            stats["visits"] = self.visits.stats()
+        return stats
 
     def insert_order(self, order):
         if self.root is None:  # if BST empty
             self.root = Node(order)  # insert the node as root
-        else:  # if not empty
-            self._insert_order(self.root, order)
-
-    def _insert_order(self, node, order):
-        # recursive method to insert data
-        if order.order_id < node.order.order_id:  # if the value is smaller than the current node
-            if node.left is None:  # the left side of the node is empty
-                node.left = Node(order)  # insert the order to left subtree as a leaf
-            else:  # if the node have left subtree
-                self._insert_order(node.left, order)  # traverse the node to the left until find the position
-        elif order.order_id > node.order.order_id:  # if the value is bigger than the current node
-            if node.right is None:
-                node.right = Node(order)
+            self._attach_order(order)
+            if self.visits is not None:
+                self.visits.observe("insert", 0)
+            return
+        # iterative descent, remember the path so the AVL backend can rebalance on the way back up
+        path = []
+        node = self.root
+        while node is not None:
+            path.append(node)
+            if order.order_id < node.order.order_id:  # if the value is smaller than the current node
+                node = node.left
+            elif order.order_id > node.order.order_id:  # if the value is bigger than the current node
+                node = node.right
+            else:  # the order ID already exists, do not insert the duplicate
+                if self.visits is not None:
+                    self.visits.observe("insert", len(path))
+                return
+        if self.visits is not None:  # the path down, and back up again for the AVL rebalancing
+            self.visits.observe("insert", 2 * len(path) if self.backend == "avl" else len(path))
+        parent = path[-1]
+        if order.order_id < parent.order.order_id:
+            parent.left = Node(order)  # insert the order to left subtree as a leaf
+        else:
+            parent.right = Node(order)  # insert the order to right subtree as a leaf
+        for node in path:  # every node on the path has one more node in its subtree
+            node.size += 1
+        self._attach_order(order)
+        if self.backend == "avl":
+            self._rebalance_path(path)
+
+    def _attach_order(self, order):
+        # the order now belongs to this tree, count its total in the revenue total and add it to the indexes
+        order.bst = self
+        self.total_revenue += order.total_amount
+        self._index_order(order)
+        if self.analytics is not None:
+            self.analytics.order_changed(order)
+
+    def _detach_order(self, order):
+        order.bst = None
+        self.total_revenue -= order.total_amount
+        self._unindex_order(order.order_id)
+        if self.analytics is not None:
+            self.analytics.order_changed(order)
+
+    def _attach_orders(self, orders):
+        # _attach_order for a batch of orders: the new customer names are sorted once and merged into sorted_names
+        # in O(names) instead of one O(names) list insert per name
+        new_names = []
+        for order in orders:
+            order.bst = self
+            self.total_revenue += order.total_amount
+            self._index_order(order, new_names)
+            if self.analytics is not None:
+                self.analytics.order_changed(order)
+        if new_names:
+            self.sorted_names = list(heapq.merge(self.sorted_names, sorted(new_names)))
+
+    def _detach_orders(self, orders):
+        # _detach_order for a batch of orders, the names left without orders are dropped in one pass at the end
+        for order in orders:
+            order.bst = None
+            self.total_revenue -= order.total_amount
+            self._unindex_order(order.order_id, keep_sorted=False)
+            if self.analytics is not None:
+                self.analytics.order_changed(order)
+        if len(self.sorted_names) != len(self.orders_by_name_index):
+            self.sorted_names = [name for name in self.sorted_names if name in self.orders_by_name_index]
+
+    @staticmethod
+    def normalise_name(name):
+        return " ".join(name.lower().split())  # ignore the case and extra spaces
+
+    def _index_order(self, order, new_names=None):
+        # new_names: list to collect the names that are new to the index, to add them to sorted_names in one go
+        contact = order.customer.contact_number
+        name = self.normalise_name(order.customer.name)
+        cake_codes = {cake.code for cake, weight, quantity in order.cake_items}
+        self.index_keys[order.order_id] = (contact, name, cake_codes)
+        self.orders_by_contact_index.setdefault(contact, {})[order.order_id] = order
+        if name not in self.orders_by_name_index:
+            self.orders_by_name_index[name] = {}
+            if new_names is None:
+                bisect.insort(self.sorted_names, name)
             else:
-                self._insert_order(node.right, order)
+                new_names.append(name)
+        self.orders_by_name_index[name][order.order_id] = order
+        for cake_code in cake_codes:
+            self.orders_by_cake_index.setdefault(cake_code, {})[order.order_id] = order
+
+    def _unindex_order(self, order_id, keep_sorted=True):
+        # keep_sorted=False leaves a name without orders in sorted_names, for the caller to drop
+        contact, name, cake_codes = self.index_keys.pop(order_id)
+        self._remove_from_index(self.orders_by_contact_index, contact, order_id)
+        if self._remove_from_index(self.orders_by_name_index, name, order_id) and keep_sorted:
+            del self.sorted_names[bisect.bisect_left(self.sorted_names, name)]
+        for cake_code in cake_codes:
+            self._remove_from_index(self.orders_by_cake_index, cake_code, order_id)
+
+    @staticmethod
+    def _remove_from_index(index, key, order_id):
+        # remove the order from index[key], return True if no order is left under that key
+        orders = index[key]
+        del orders[order_id]
+        if not orders:
+            del index[key]
+            return True
+        return False
+
+    def reindex_order(self, order):
+        # call after changing the customer details or the cake items of an order that is in the tree
+        self._unindex_order(order.order_id)
+        self._index_order(order)
+
+    def orders_by_contact(self, contact):
+        return list(self.orders_by_contact_index.get(contact, {}).values())
+
+    def customer_orders(self, customer):
+        # all orders of a customer record (orders of repeat customers share one record)
+        return [order for order in self.orders_by_contact(customer.contact_number) if order.customer is customer]
+
+    def orders_by_cake(self, cake_code):
+        return list(self.orders_by_cake_index.get(cake_code, {}).values())
+
+    def orders_by_name_prefix(self, prefix):
+        # all orders whose customer name starts with prefix (case and extra spaces are ignored)
+        prefix = self.normalise_name(prefix)
+        orders = []
+        i = bisect.bisect_left(self.sorted_names, prefix)
+        while i < len(self.sorted_names) and self.sorted_names[i].startswith(prefix):
+            orders.extend(self.orders_by_name_index[self.sorted_names[i]].values())
+            i += 1
+        return orders
+
+    def bulk_load(self, orders):
+        # add a batch of orders at once: sort the batch (skipped if it is already sorted), merge it with the
+        # orders already in the tree and rebuild a perfectly balanced tree, instead of one insert per order
+        orders = list(orders)
+        if self._one_by_one(len(orders)):  # a small batch into a big tree, inserting is cheaper than a rebuild
+            for order in orders:
+                self.insert_order(order)
+            return
+        if any(orders[i].order_id > orders[i + 1].order_id for i in range(len(orders) - 1)):
+            orders.sort(key=lambda order: order.order_id)  # stable, so the first of duplicate IDs stays first
+        self._build_from_sorted(self._merge_sorted(self.iter_orders(), orders))
+
+    def merge(self, other):
+        # move all orders of another tree (e.g. another shard) into this one, the other tree becomes empty
+        other_orders = list(other.iter_orders())
+        other._detach_orders(other_orders)
+        other.root = None
+        self._build_from_sorted(self._merge_sorted(self.iter_orders(), other_orders))
+
+    @staticmethod
+    def _merge_sorted(first, second):
+        # merge two sequences of orders sorted by order ID in O(n + m), on a duplicate ID the one in first is kept
+        merged = []
+        for order in heapq.merge(first, second, key=lambda order: order.order_id):
+            if not merged or merged[-1].order_id != order.order_id:
+                merged.append(order)
+        return merged
+
+    def _build_from_sorted(self, orders):
+        # replace the tree with a perfectly balanced tree of the orders (sorted by order ID, no duplicates) in O(n)
+        # only the node structure is built again: the revenue total, the indexes and the analytics are only
+        # updated for the orders that are new to the tree or no longer in it
+        added = [order for order in orders if order.bst is not self]
+        if len(orders) - len(added) != len(self):  # some orders of the tree are not in the new tree
+            kept = {id(order) for order in orders}
+            self._detach_orders([order for order in self.iter_orders() if id(order) not in kept])
+        self.root = self._build_subtree(orders, 0, len(orders) - 1)
+        self._attach_orders(added)
+
+    def _build_subtree(self, orders, low, high):
+        # the middle order becomes the subtree root, the recursion is only O(log n) levels deep
+        if low > high:
+            return None
+        middle = (low + high) // 2
+        node = Node(orders[middle])
+        node.left = self._build_subtree(orders, low, middle - 1)
+        node.right = self._build_subtree(orders, middle + 1, high)
+        self._update_node(node)
+        return node
+
+    def height(self):
+        # height of the whole tree (0 if empty), computed by walking the tree so it is correct for both backends
+        height = 0
+        level = [self.root] if self.root is not None else []
+        while level:  # level-order walk, one loop per level of the tree
+            height += 1
+            level = [child for node in level for child in (node.left, node.right) if child is not None]
+        return height
+
+    @staticmethod
+    def _node_height(node):
+        return node.height if node is not None else 0
+
+    @staticmethod
+    def _node_size(node):
+        return node.size if node is not None else 0
+
+    def _update_node(self, node):
+        # recalculate the height and size of the node from its children
+        node.height = 1 + max(self._node_height(node.left), self._node_height(node.right))
+        node.size = 1 + self._node_size(node.left) + self._node_size(node.right)
+
+    def _balance_factor(self, node):
+        return self._node_height(node.left) - self._node_height(node.right)
+
+    def _rotate_right(self, node):
+        #       node            pivot
+        #       /    \          /    \
+        #    pivot    C   ->   A     node
+        #    /   \                   /   \
+        #   A     B                 B     C
+        pivot = node.left
+        node.left = pivot.right
+        pivot.right = node
+        self._update_node(node)
+        self._update_node(pivot)
+        self.rotations += 1
+        return pivot
+
+    def _rotate_left(self, node):
+        # mirror image of _rotate_right
+        pivot = node.right
+        node.right = pivot.left
+        pivot.left = node
+        self._update_node(node)
+        self._update_node(pivot)
+        self.rotations += 1
+        return pivot
+
+    def _rebalance(self, node):
+        # restore the AVL property (|balance factor| <= 1) for the node and return the new subtree root
+        self._update_node(node)
+        balance = self._balance_factor(node)
+        if balance > 1:  # left heavy
+            if self._balance_factor(node.left) < 0:  # left-right case
+                node.left = self._rotate_left(node.left)
+            return self._rotate_right(node)  # left-left case
+        if balance < -1:  # right heavy
+            if self._balance_factor(node.right) > 0:  # right-left case
+                node.right = self._rotate_right(node.right)
+            return self._rotate_left(node)  # right-right case
+        return node
+
+    def _rebalance_path(self, path):
+        # rebalance every node on the root-to-leaf path, starting from the bottom, and relink the new subtree roots
+        for i in range(len(path) - 1, -1, -1):
+            node = path[i]
+            new_node = self._rebalance(node)
+            if new_node is not node:
+                self._replace_child(path[i - 1] if i > 0 else None, node, new_node)
+
+    def _replace_child(self, parent, old_child, new_child):
+        # point the parent (or the root if there is no parent) to the new child instead of the old one
+        if parent is None:
+            self.root = new_child
+        elif parent.left is old_child:
+            parent.left = new_child
+        else:
+            parent.right = new_child
 
     def search_order(self, order_id):
-        return self._search_order(self.root, order_id)
-
-    def _search_order(self, node, order_id):
-        # recursive method to search order
-        if node is None or node.order.order_id == order_id:  # Return None if empty or don't have the order ID
-            return node.order if node else None  # Return node.order if the order ID is found
-        if order_id < node.order.order_id:  # if the order ID is smaller than the node order ID
-            return self._search_order(node.left, order_id)  # move the node to left and check again
-        else:  # if the order ID is larger than the node order ID
-            return self._search_order(node.right, order_id)  # move the node to right and check again
-
-    def display_all_order_ids(self):
+        if self.visits is not None:
+            return self._counted_search(order_id)
+        node = self.root
+        while node is not None:
+            if order_id == node.order.order_id:
+                return node.order  # Return node.order if the order ID is found
+            if order_id < node.order.order_id:  # if the order ID is smaller than the node order ID
+                node = node.left  # move the node to left and check again
+            else:  # if the order ID is larger than the node order ID
+                node = node.right  # move the node to right and check again
+        return None  # Return None if empty or don't have the order ID
+
+    def _counted_search(self, order_id):
+        # search_order counting the nodes it visits, a separate loop so the search costs nothing extra without
+        # the metrics
+        visits = 0
+        node = self.root
+        while node is not None:
+            visits += 1
+            if order_id == node.order.order_id:
+                break
+            node = node.left if order_id < node.order.order_id else node.right
+        self.visits.observe("search", visits)
+        return node.order if node is not None else None
+
+    def iter_orders(self):
+        # generator yielding the orders in order ID order (in-order traversal with an explicit stack)
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:  # go down to the leftmost node, remembering the path
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.order
+            node = node.right
+
+    def __len__(self):
+        return self._node_size(self.root)
+
+    def floor(self, order_id):
+        # the order with the largest order ID <= order_id, None if there is none
+        found = None
+        node = self.root
+        while node is not None:
+            if order_id < node.order.order_id:
+                node = node.left
+            else:  # this node is a candidate, look for a bigger one on the right
+                found = node.order
+                if order_id == node.order.order_id:
+                    break
+                node = node.right
+        return found
+
+    def ceiling(self, order_id):
+        # the order with the smallest order ID >= order_id, None if there is none
+        found = None
+        node = self.root
+        while node is not None:
+            if order_id > node.order.order_id:
+                node = node.right
+            else:  # this node is a candidate, look for a smaller one on the left
+                found = node.order
+                if order_id == node.order.order_id:
+                    break
+                node = node.left
+        return found
+
+    def kth_smallest(self, k):
+        # the order with the k-th smallest order ID (k starts from 1), None if k is out of range
+        node = self.root
+        while node is not None:
+            left_size = self._node_size(node.left)
+            if k <= left_size:
+                node = node.left
+            elif k == left_size + 1:
+                return node.order
+            else:  # skip the left subtree and this node
+                k -= left_size + 1
+                node = node.right
+        return None
+
+    def rank(self, order_id):
+        # number of orders with an order ID smaller than order_id
+        smaller = 0
+        node = self.root
+        while node is not None:
+            if order_id <= node.order.order_id:
+                node = node.left
+            else:  # this node and its left subtree are all smaller
+                smaller += self._node_size(node.left) + 1
+                node = node.right
+        return smaller
+
+    def range(self, low, high):
+        # generator yielding the orders with low <= order ID <= high in order, O(log n + number of orders)
+        for order in self._iter_orders_from(low):
+            if order.order_id > high:
+                return
+            yield order
+
+    def _iter_orders_from(self, low):
+        # in-order traversal that starts at the first order ID >= low instead of the smallest one
+        stack = []
+        node = self.root
+        while node is not None:  # keep only the nodes >= low on the stack, they are visited later
+            if node.order.order_id >= low:
+                stack.append(node)
+                node = node.left
+            else:
+                node = node.right
+        while stack:
+            node = stack.pop()
+            yield node.order
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    def get_page(self, page_number, page_size):
+        # the orders on page page_number (starts from 1) when the orders are split into pages of page_size
+        first = self.kth_smallest((page_number - 1) * page_size + 1)
+        if first is None:  # past the last page
+            return []
+        return list(itertools.islice(self._iter_orders_from(first.order_id), page_size))
+
+    def page_after(self, cursor, page_size):
+        # the next page_size orders with an order ID bigger than cursor (None for the first page)
+        # pass the order ID of the last order of a page as the cursor to get the page after it
+        if cursor is None:
+            orders = self.iter_orders()
+        else:  # start at the cursor, skipping the order with the cursor ID itself if it is still there
+            orders = itertools.dropwhile(lambda order: order.order_id <= cursor, self._iter_orders_from(cursor))
+        return list(itertools.islice(orders, page_size))
+
+    def iter_orders_paged(self, page_size=1000):
+        # every order in order ID order, page_size orders at a time with page_after. A LockedOrderBST reads each
+        # page under the lock instead of copying the whole tree like its iter_orders() does, so the memory use
+        # stays the same for any number of orders (orders changed while iterating may or may not be seen)
+        cursor = None
+        while True:
+            orders = self.page_after(cursor, page_size)
+            yield from orders
+            if len(orders) < page_size:
+                return
+            cursor = orders[-1].order_id
+
+    def display_all_order_ids(self, output=None, chunk_size=1000):
+        # print the order IDs that are in the BST in order, the lines are joined and written chunk_size orders
+        # at a time instead of one print per order
+        output = output if output is not None else sys.stdout
         if self.root is None:  # if the BST is empty
-            print("There are no orders.")
+            output.write("There are no orders.\n")
             return
-        self._display_all_order_ids(self.root)
-
-    def _display_all_order_ids(self, node):
-        if node is not None:  # print the order IDs that are in the BST using in-order traversal
-            self._display_all_order_ids(node.left)
-            order = node.order
-            print(f"Order ID: {order.order_id}\tCustomer Name: {order.customer.name}\t"
-                  f"Total Amount: RM {order.calculate_total_amount():.2f}")
-            self._display_all_order_ids(node.right)
+        lines = []
+        for order in self.iter_orders():
+            lines.append(f"Order ID: {order.order_id}\tCustomer Name: {order.customer.name}\t"
+                         f"Total Amount: RM {order.calculate_total_amount():.2f}\n")
+            if len(lines) >= chunk_size:
+                output.write("".join(lines))
+                lines = []
+        output.write("".join(lines))
 
     def view_orders_details(self, current_node, order):
-        # display all the order details for selected order ID using in-order traversal
-        if current_node is not None:  # if the current node is not empty
-            self.view_orders_details(current_node.left, order)
-            # the current node traversal from the left child to search on the order id
-            if current_node.order.order_id == order.order_id:  # when the order id is matched, print the order details
-                print("\n----------------------------------------------------------------------------------------------")
-                print(f"Order ID: {current_node.order.order_id}")
-                print("--- Customer Details ---")
-                print(f"Customer ID: {current_node.order.customer.customer_id}")
-                print(f"Name: {current_node.order.customer.name}")
-                print(f"Address: {current_node.order.customer.address}")
-                print(f"Contact Number: {current_node.order.customer.contact_number}")
-                print("\n--- Cake Order Details ---")
-                for cake, weight, quantity in current_node.order.cake_items:
-                    print(f"Cake Code: {cake.code}")
-                    print(f"Flavour: {cake.flavour}")
-                    print(f"Weight: {weight} kg")
-                    print(f"Quantity: {quantity}")
-                    print("")
-                print(f"Total Amount: RM {current_node.order.calculate_total_amount():.2f}")
-                print("----------------------------------------------------------------------------------------------")
-            self.view_orders_details(current_node.right, order)
-            # the current node traversal from the right child to search on the order id
+        # display the order details for selected order ID if it is in the subtree of current_node
+        while current_node is not None and current_node.order.order_id != order.order_id:
+            current_node = current_node.left if order.order_id < current_node.order.order_id else current_node.right
+        if current_node is not None:  # when the order id is matched, print the order details
+            self.render_order(current_node.order)
+
+    @staticmethod
+    def render_order(order):
+        # print all the details of an order that is already located (e.g. by search_order), no tree walk needed
+        lines = ["\n----------------------------------------------------------------------------------------------",
+                 f"Order ID: {order.order_id}",
+                 "--- Customer Details ---",
+                 f"Customer ID: {order.customer.customer_id}",
+                 f"Name: {order.customer.name}",
+                 f"Address: {order.customer.address}",
+                 f"Contact Number: {order.customer.contact_number}",
+                 "\n--- Cake Order Details ---"]
+        for cake, weight, quantity in order.cake_items:
+            lines += [f"Cake Code: {cake.code}", f"Flavour: {cake.flavour}", f"Weight: {weight} kg",
+                      f"Quantity: {quantity}", ""]
+        lines += [f"Total Amount: RM {order.calculate_total_amount():.2f}",
+                  "----------------------------------------------------------------------------------------------"]
+        print("\n".join(lines))  # one write for the whole order
 
     def modify_order(self, order_id, new_cake_code, new_flavour, new_weight, new_quantity, new_unit_price,
                      new_customer_name, new_customer_address, new_contact):
         # modify the details of a specific order
-        self._modify_recursive(self.root, order_id, new_cake_code, new_flavour, new_weight, new_quantity,
-                               new_unit_price, new_customer_name, new_customer_address, new_contact)
-
-    def _modify_recursive(self, current_node, order_id, new_cake_code, new_flavour, new_weight, new_quantity,
-                          new_unit_price, new_customer_name, new_customer_address, new_contact):
-        # private helper method
-        if current_node.order.order_id == order_id:  # when the order ID is found
-            total_amount = 0.0  # assign the total amount to 0 so that can recalculate the total
-            for i, (cake, weight, quantity) in enumerate(current_node.order.cake_items):
-                # to update the cake lists in the order by assigning the new value
-                if cake.code == new_cake_code:
-                    # Update cake details base on the cake code
-                    cake.code = new_cake_code
-                    cake.flavour = new_flavour
-                    cake.unit_price = new_unit_price
-                    current_node.order.cake_items[i] = (cake, new_weight, new_quantity)
-                    # update the order cake details based on new value into the tuple list
-                subtotal = cake.unit_price * new_weight * new_quantity
-                total_amount += subtotal
-            current_node.order.total_amount = total_amount
-            current_node.order.customer_name = new_customer_name
-            current_node.order.customer_address = new_customer_address
-            current_node.order.customer.contact_number = new_contact
-
-        elif order_id < current_node.order.order_id:
-            self._modify_recursive(current_node.left, order_id, new_cake_code, new_flavour, new_weight, new_quantity,
-                                   new_unit_price, new_customer_name, new_customer_address, new_contact)
-        else:
-            self._modify_recursive(current_node.right, order_id, new_cake_code, new_flavour, new_weight, new_quantity,
-                                   new_unit_price, new_customer_name, new_customer_address, new_contact)
+        order = self.search_order(order_id)
+        if order is None:  # the order ID is not in the tree, nothing to modify
+            return
+        self._modify(order, new_cake_code, new_flavour, new_weight, new_quantity, new_unit_price, new_customer_name,
+                     new_customer_address, new_contact)
+
+    def _modify(self, order, new_cake_code, new_flavour, new_weight, new_quantity, new_unit_price, new_customer_name,
+                new_customer_address, new_contact):
+        for i, (cake, weight, quantity) in enumerate(order.cake_items):
+            # to update the cake lists in the order by assigning the new value
+            if cake.code == new_cake_code:
+                # Update cake details base on the cake code (cake records are read-only so replace it)
+                cake = Cake(new_cake_code, new_flavour, cake.weight, new_unit_price)
+                order.set_cake_item(i, cake, new_weight, new_quantity)
+                # update the order cake details (and the order total) based on new value
+        customer_orders = self.customer_orders(order.customer)  # the customer record is shared by these orders
+        order.customer.name = new_customer_name
+        order.customer.address = new_customer_address
+        order.customer.contact_number = new_contact
+        self.reindex_order(order)  # the contact, name and cake codes may have changed
+        for customer_order in customer_orders:
+            if customer_order is not order:
+                self.reindex_order(customer_order)
 
     def delete_order(self, order_id):
-        self.root = self._delete_order(self.root, order_id)
-
-    def _delete_order(self, node, order_id):
-        # To find the target node
+        # To find the target node, remembering the path from the root
+        path = []
+        node = self.root
+        while node is not None and node.order.order_id != order_id:
+            path.append(node)
+            node = node.left if order_id < node.order.order_id else node.right
         if node is None:  # if the order ID not found
-            return node
-        if order_id < node.order.order_id:
-            node.left = self._delete_order(node.left, order_id)
-        elif order_id > node.order.order_id:
-            node.right = self._delete_order(node.right, order_id)
-        else:  # Target found
-            # Node with no child or only one child
-            if node.left is None:  # The node does not have left child ( 1 right child )
-                temp = node.right  # temp (pointer in C++) point to the right child
-                node = None  # delete the node
-                return temp  # the right child become the new node
-            elif node.right is None:  # The node does not have right child ( 1 left child )
-                temp = node.left
-                node = None
-                return temp
-            # The target node has two children
-            temp = self._min_value_node(node.right)  # Find the successor node (smallest in the right subtree)
-            node.order = temp.order  # replaces the target node's content with the order of the successor node
-            node.right = self._delete_order(node.right, temp.order.order_id)  # Delete the inorder successor
-        return node
+            if self.visits is not None:
+                self.visits.observe("delete", len(path))
+            return
+        self._detach_order(node.order)
+        # The target node has two children
+        if node.left is not None and node.right is not None:
+            path.append(node)
+            successor = node.right  # Find the successor node (smallest in the right subtree)
+            while successor.left is not None:
+                path.append(successor)
+                successor = successor.left
+            node.order = successor.order  # replaces the target node's content with the order of the successor node
+            node = successor  # the successor is removed instead (it has no left child)
+        # Node with no child or only one child, the child (or None) takes its place
+        child = node.left if node.left is not None else node.right
+        self._replace_child(path[-1] if path else None, node, child)
+        for node in path:  # every node on the path has one node less in its subtree
+            node.size -= 1
+        if self.visits is not None:  # the path to the removed node, and back up again for the AVL rebalancing
+            self.visits.observe("delete", len(path) + 1 + (len(path) if self.backend == "avl" else 0))
+        if self.backend == "avl":
+            self._rebalance_path(path)  # rebalance every node on the path back to the root
+
+    def _one_by_one(self, count):
+        # True if count separate O(log n) operations are cheaper than one O(n) pass over the whole tree
+        size = len(self)
+        return count * max(1, size.bit_length()) < size
+
+    def modify_many(self, updates):
+        # updates are tuples with the arguments of modify_order, (order_id, new_cake_code, ..., new_contact)
+        # a big batch is sorted and matched against one in-order walk of the tree instead of one search per
+        # update, order IDs that are not in the tree are skipped. Return the number of updates applied
+        updates = sorted(updates, key=lambda update: update[0])  # stable, updates of the same ID keep their order
+        if not updates:
+            return 0
+        if self._one_by_one(len(updates)):
+            orders = [self.search_order(update[0]) for update in updates]
+        else:
+            orders = []
+            position = 0
+            for order in self._iter_orders_from(updates[0][0]):
+                while position < len(updates) and updates[position][0] < order.order_id:  # not in the tree
+                    orders.append(None)
+                    position += 1
+                while position < len(updates) and updates[position][0] == order.order_id:
+                    orders.append(order)
+                    position += 1
+                if position == len(updates):
+                    break
+            orders += [None] * (len(updates) - len(orders))  # IDs bigger than the last order ID
+        modified = 0
+        for order, update in zip(orders, updates):
+            if order is not None:
+                self._modify(order, *update[1:])
+                modified += 1
+        return modified
+
+    def delete_many(self, order_ids):
+        # delete a batch of orders, order IDs that are not in the tree are skipped. Return the deleted orders
+        order_ids = set(order_ids)
+        if not self._one_by_one(len(order_ids)):
+            return self.delete_where(lambda order: order.order_id in order_ids)
+        deleted = []
+        for order_id in sorted(order_ids):
+            order = self.search_order(order_id)
+            if order is not None:
+                self.delete_order(order_id)
+                deleted.append(order)
+        return deleted
+
+    def delete_range(self, low, high):
+        # delete every order with low <= order ID <= high, return the deleted orders
+        return self.delete_many([order.order_id for order in self.range(low, high)])
+
+    def delete_where(self, predicate):
+        # delete every order for which predicate(order) is True with one in-order pass: the orders that stay
+        # are built into a balanced tree again in O(n) instead of n deletes of O(log n). Return the deleted orders
+        kept = []
+        deleted = []
+        for order in self.iter_orders():
+            (deleted if predicate(order) else kept).append(order)
+        if deleted:
+            self._detach_orders(deleted)
+            self.root = self._build_subtree(kept, 0, len(kept) - 1)
+        return deleted
+
+
+class ReadWriteLock:
+    # many readers or one writer at a time, waiting writers go first so that they are not starved by readers
+    # a thread that holds the lock can take it again (e.g. a write method calling a read method)
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = None  # the thread holding the write lock
+        self.waiting_writers = 0
+        self.local = threading.local()  # read lock depth of each thread
+
+    @contextlib.contextmanager
+    def read(self):
+        depth = getattr(self.local, "depth", 0)
+        if depth or self.writer is threading.current_thread():  # already holding the lock
+            yield
+            return
+        with self.condition:
+            while self.writer is not None or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+        self.local.depth = 1
+        try:
+            yield
+        finally:
+            self.local.depth = 0
+            with self.condition:
+                self.readers -= 1
+                if self.readers == 0:
+                    self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def write(self):
+        current = threading.current_thread()
+        if self.writer is current:  # already holding the write lock
+            yield
+            return
+        if getattr(self.local, "depth", 0):
+            raise RuntimeError("Cannot take the write lock while holding the read lock.")
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writer is not None or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = current
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writer = None
+                self.condition.notify_all()
+
+
+def _with_lock(mode, method):
+    # wrap an OrderBST method so that it runs under the read or the write lock of the tree
+    def locked_method(self, *args, **kwargs):
+        with getattr(self.lock, mode)():
+            return method(self, *args, **kwargs)
+    locked_method.__name__ = method.__name__
+    locked_method.__doc__ = method.__doc__
+    return locked_method
+
+
+class LockedOrderBST(OrderBST):
+    # OrderBST that can be shared by several threads: lookups run in parallel, changes run one at a time
+    # changes made directly to an order in the tree (e.g. set_cake_item) should be done inside "with tree.lock.write():"
+    def __init__(self, backend="bst"):
+        super().__init__(backend)
+        self.lock = ReadWriteLock()
+
+    def iter_orders(self):
+        # the orders are copied under the read lock so the caller gets a consistent view without holding the lock
+        # this holds every order in a list, iter_orders_paged() streams them (e.g. for an export of a big tree)
+        with self.lock.read():
+            orders = list(OrderBST.iter_orders(self))
+        return iter(orders)
+
+    def range(self, low, high):
+        with self.lock.read():
+            orders = list(OrderBST.range(self, low, high))
+        return iter(orders)
+
+    search_order = _with_lock("read", OrderBST.search_order)
+    height = _with_lock("read", OrderBST.height)
+    __len__ = _with_lock("read", OrderBST.__len__)
+    floor = _with_lock("read", OrderBST.floor)
+    ceiling = _with_lock("read", OrderBST.ceiling)
+    kth_smallest = _with_lock("read", OrderBST.kth_smallest)
+    rank = _with_lock("read", OrderBST.rank)
+    get_page = _with_lock("read", OrderBST.get_page)
+    page_after = _with_lock("read", OrderBST.page_after)
+    orders_by_contact = _with_lock("read", OrderBST.orders_by_contact)
+    orders_by_cake = _with_lock("read", OrderBST.orders_by_cake)
+    orders_by_name_prefix = _with_lock("read", OrderBST.orders_by_name_prefix)
+    customer_orders = _with_lock("read", OrderBST.customer_orders)
+    display_all_order_ids = _with_lock("read", OrderBST.display_all_order_ids)
+    view_orders_details = _with_lock("read", OrderBST.view_orders_details)
+
+    insert_order = _with_lock("write", OrderBST.insert_order)
+    delete_order = _with_lock("write", OrderBST.delete_order)
+    modify_order = _with_lock("write", OrderBST.modify_order)
+    modify_many = _with_lock("write", OrderBST.modify_many)
+    delete_many = _with_lock("write", OrderBST.delete_many)
+    delete_range = _with_lock("write", OrderBST.delete_range)
+    delete_where = _with_lock("write", OrderBST.delete_where)
+    reindex_order = _with_lock("write", OrderBST.reindex_order)
+    bulk_load = _with_lock("write", OrderBST.bulk_load)
+    merge = _with_lock("write", OrderBST.merge)
+
+
+class SequentialIdAllocator:
+    # hands out order IDs one after another: start, start + 1, ... stop
+    def __init__(self, start=1, stop=None):
+        self.next_id = start
+        self.stop = stop  # None means there is no upper limit
+
+    def allocate(self):
+        if self.stop is not None and self.next_id > self.stop:
+            raise RuntimeError("No more order IDs available.")
+        order_id = self.next_id
+        self.next_id += 1
+        return order_id
+
+    def release(self, order_id):
+        pass  # the IDs are never reused
+
+    def reserve(self, order_id):
+        # an order with this ID already exists (e.g. loaded from the store), new IDs start after it
+        if order_id >= self.next_id:
+            self.next_id = order_id + 1
+
+
+class ShuffledIdAllocator:
+    # hands out the IDs in [start, stop] in random order without repeats (lazy Fisher-Yates shuffle)
+    # the offsets (ID - start) are kept in a virtual array of positions: [0, remaining) are free and
+    # [remaining, size) are handed out. Only the positions that do not hold their own offset are stored, so a big
+    # ID space does not need a big list
+    def __init__(self, start=100, stop=10000, rng=None):
+        self.start = start
+        self.size = stop - start + 1
+        self.remaining = self.size  # positions [0, remaining) are still free
+        self.swapped = {}  # position -> offset, for the positions that do not hold their own offset
+        self.positions = {}  # offset -> position, the other way round
+        self.rng = rng if rng is not None else random.Random()
+
+    def _swap(self, i, j):
+        # swap the offsets at positions i and j
+        offset_i = self.swapped.get(i, i)
+        offset_j = self.swapped.get(j, j)
+        self._place(i, offset_j)
+        self._place(j, offset_i)
+
+    def _place(self, position, offset):
+        if position == offset:
+            self.swapped.pop(position, None)
+            self.positions.pop(offset, None)
+        else:
+            self.swapped[position] = offset
+            self.positions[offset] = position
+
+    def allocate(self):
+        if self.remaining == 0:
+            raise RuntimeError("No more order IDs available.")
+        last = self.remaining - 1
+        self._swap(self.rng.randrange(self.remaining), last)  # the picked offset goes to the last free position
+        self.remaining -= 1
+        return self.start + self.swapped.get(last, last)
+
+    def release(self, order_id):
+        # put a deleted order ID back into the free pool, IDs outside [start, stop] or not handed out are ignored
+        offset = order_id - self.start
+        if not 0 <= offset < self.size:
+            return
+        position = self.positions.get(offset, offset)
+        if position < self.remaining:  # already free
+            return
+        self._swap(position, self.remaining)  # the first handed-out position becomes free
+        self.remaining += 1
 
-    @staticmethod  # does not depend on any instance-specific data and does not modify the state of the object
-    def _min_value_node(node):
-        # to find the smallest value of order ID
-        current = node
-        while current.left is not None:  # loop down to find the smallest value leaf
-            current = current.left
-        return current
+    def reserve(self, order_id):
+        # take an ID out of the free pool because an order already has it (e.g. loaded from the store)
+        offset = order_id - self.start
+        if not 0 <= offset < self.size:
+            return
+        position = self.positions.get(offset, offset)
+        if position >= self.remaining:  # already handed out
+            return
+        self.remaining -= 1
+        self._swap(position, self.remaining)
+
+
+class SnowflakeIdAllocator:
+    # 64-bit IDs made of | 41 bits milliseconds since the epoch | 10 bits worker ID | 12 bits sequence |
+    epoch_ms = 1704067200000  # 2024-01-01 00:00:00 UTC
+    worker_bits = 10
+    sequence_bits = 12
+
+    def __init__(self, worker_id=0, clock=None):
+        if not 0 <= worker_id < (1 << self.worker_bits):
+            raise ValueError(f"Worker ID must be between 0 and {(1 << self.worker_bits) - 1}.")
+        self.worker_id = worker_id
+        self.clock = clock if clock is not None else time.time
+        self.last_ms = -1
+        self.sequence = 0
+
+    def _now_ms(self):
+        return int(self.clock() * 1000) - self.epoch_ms
+
+    def allocate(self):
+        now = self._now_ms()
+        if now < self.last_ms:  # the clock went backwards, keep counting from the last timestamp
+            now = self.last_ms
+        if now == self.last_ms:
+            self.sequence = (self.sequence + 1) & ((1 << self.sequence_bits) - 1)
+            if self.sequence == 0:  # 4096 IDs used in this millisecond, wait for the next one
+                while now <= self.last_ms:
+                    now = self._now_ms()
+        else:
+            self.sequence = 0
+        self.last_ms = now
+        return (now << (self.worker_bits + self.sequence_bits)) | (self.worker_id << self.sequence_bits) | self.sequence
+
+    def release(self, order_id):
+        pass  # the IDs are never reused
+
+    def reserve(self, order_id):
+        pass  # new IDs are newer than the existing ones anyway
+
+
+class OrderStore:
+    # keeps the orders on disk: a snapshot file of all orders (sorted by order ID) plus a write-ahead log (WAL)
+    # of the inserts, modifications and deletions done after the snapshot. Cakes changed in the catalog are kept
+    # the same way: a cakes file written with each snapshot plus "cake" records in the log
+    snapshot_name = "orders.snapshot.jsonl"
+    log_name = "orders.wal.jsonl"
+    cakes_name = "cakes.json"
+
+    def __init__(self, directory, sync_every=32, snapshot_every=10000):
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, self.snapshot_name)
+        self.log_path = os.path.join(directory, self.log_name)
+        self.cakes_path = os.path.join(directory, self.cakes_name)
+        self.sync_every = sync_every  # fsync the log after this many operations (1 = after every operation)
+        self.snapshot_every = snapshot_every  # write a new snapshot after this many logged operations
+        self.bst = None
+        self.changed_cakes = {}  # cake code -> Cake added or replaced through OrderService.change_cake()
+        self.log_file = None
+        self.unsynced = 0  # operations written to the log but not fsynced yet
+        self.logged = 0  # operations logged since the last snapshot
+        self.last_load_seconds = None  # how long the last load() took, to keep an eye on the startup time
+
+    def load(self, backend="avl", tree_class=OrderBST):
+        # crash recovery: build the tree from the snapshot, then replay the log on top of it
+        start = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        self.bst = tree_class(backend=backend)
+        cakes = {}  # share one Cake record between all the order lines of the same cake
+        customers = {}  # and one Customer record between all the orders of the same customer ID
+        self.changed_cakes = {}
+        if os.path.exists(self.cakes_path):
+            with open(self.cakes_path, encoding="utf-8") as cakes_file:
+                for record in json.load(cakes_file):
+                    cake = Cake(*record)
+                    self.changed_cakes[cake.code] = cake
+        if os.path.exists(self.snapshot_path):
+            decode = json.JSONDecoder().decode
+            order_from_record = self.order_from_record
+            with open(self.snapshot_path, encoding="utf-8") as snapshot:
+                orders = [order_from_record(decode(line), cakes, customers) for line in snapshot]
+            self.bst._build_from_sorted(orders)  # already sorted, no per-order insert needed
+        self.logged = self._replay_log(cakes, customers)
+        Customer.skip_ids(customers)  # new customers get IDs after the saved ones
+        self.log_file = open(self.log_path, "a", encoding="utf-8")
+        self.last_load_seconds = time.perf_counter() - start
+        return self.bst
+
+    def _replay_log(self, cakes, customers):
+        if not os.path.exists(self.log_path):
+            return 0
+        replayed = 0
+        valid_size = 0  # size of the log up to the last complete record
+        with open(self.log_path, "rb") as log:
+            for line in log:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # half-written record from a crash, ignore it and everything after it
+                    break
+                if record["op"] == "delete":
+                    self.bst.delete_order(record["order_id"])
+                elif record["op"] == "cake":
+                    cake = Cake(*record["cake"])
+                    self.changed_cakes[cake.code] = cake
+                else:  # "insert" or "modify", the record holds the full order
+                    customer_id, name, address, contact = record["order"]["customer"]
+                    customer = customers.get(customer_id)
+                    customer_orders = []
+                    if customer is not None and (customer.name, customer.address,
+                                                 customer.contact_number) != (name, address, contact):
+                        customer_orders = self.bst.customer_orders(customer)  # reindexed below with the new details
+                    order = self.order_from_record(record["order"], cakes, customers)
+                    self.bst.delete_order(order.order_id)
+                    self.bst.insert_order(order)
+                    for customer_order in customer_orders:  # the customer details have changed
+                        if customer_order.bst is self.bst and customer_order is not order:
+                            self.bst.reindex_order(customer_order)
+                replayed += 1
+                valid_size += len(line)
+        with open(self.log_path, "r+b") as log:
+            log.truncate(valid_size)  # so that new records are not appended after a broken one
+        return replayed
+
+    def log_insert(self, order):
+        self._append({"op": "insert", "order": self.order_to_record(order)})
+
+    def log_modify(self, order):
+        self._append({"op": "modify", "order": self.order_to_record(order)})
+
+    def log_delete(self, order_id):
+        self._append({"op": "delete", "order_id": order_id})
+
+    def log_cake(self, cake):
+        self.changed_cakes[cake.code] = cake
+        self._append({"op": "cake", "cake": self.cake_to_record(cake)})
+
+    def _append(self, record):
+        self.log_file.write(json.dumps(record) + "\n")
+        self.unsynced += 1
+        self.logged += 1
+        if self.unsynced >= self.sync_every:  # fsync in batches instead of after every operation
+            self.sync()
+        if self.logged >= self.snapshot_every:
+            self.snapshot()
+
+    def sync(self):
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+        self.unsynced = 0
+
+    def snapshot(self):
+        # write the changed cakes and all the orders in order ID order to new files, then start an empty log
+        temp_path = self.cakes_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as cakes_file:
+            json.dump([self.cake_to_record(cake) for cake in self.changed_cakes.values()], cakes_file)
+            cakes_file.flush()
+            os.fsync(cakes_file.fileno())
+        os.replace(temp_path, self.cakes_path)  # replaying the old log on top of it changes nothing
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as snapshot:
+            snapshot.writelines(json.dumps(self.order_to_record(order)) + "\n" for order in self.bst.iter_orders())
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temp_path, self.snapshot_path)  # the old snapshot stays valid until this point
+        self.log_file.close()
+        self.log_file = open(self.log_path, "w", encoding="utf-8")
+        self.unsynced = 0
+        self.logged = 0
+
+    def close(self):
+        if self.log_file is not None:
+            self.sync()
+            self.log_file.close()
+            self.log_file = None
 
+    @staticmethod
+    def cake_to_record(cake):
+        return [cake.code, cake.flavour, cake.weight, cake.unit_price]
 
-class CakeOrderingSystem:
-    def __init__(self):
-        self.bst = OrderBST()
-        self.cake_lists = []  # List to store available cake objects
+    @staticmethod
+    def order_to_record(order):
+        customer = order.customer
+        return {
+            "order_id": order.order_id,
+            "customer": [customer.customer_id, customer.name, customer.address, customer.contact_number],
+            "items": [[cake.code, cake.flavour, cake.weight, cake.unit_price, weight, quantity]
+                      for cake, weight, quantity in order.cake_items],
+        }
+
+    @staticmethod
+    def order_from_record(record, cakes, customers):
+        customer_id, name, address, contact = record["customer"]
+        customer = customers.get(customer_id)
+        if customer is None:
+            customer = customers[customer_id] = Customer(name, address, contact, customer_id)  # keep the saved ID
+        else:  # the latest record has the latest customer details
+            customer.name = name
+            customer.address = address
+            customer.contact_number = contact
+        order = Order(customer)
+        order.set_order_id(record["order_id"])
+        for code, flavour, cake_weight, unit_price, weight, quantity in record["items"]:
+            key = (code, flavour, cake_weight, unit_price)
+            cake = cakes.get(key)
+            if cake is None:
+                cake = cakes[key] = Cake(code, flavour, cake_weight, unit_price)
+            order.add_cake(cake, weight, quantity)
+        return order
+
+
+class OrderNotFoundError(ValueError):
+    # the order ID of a request is not in the tree
+    pass
+
+
+class LineItem:
+    # one cake line of an order request
+    __slots__ = ("cake_code", "weight", "quantity")
+
+    def __init__(self, cake_code, weight, quantity):
+        self.cake_code = cake_code
+        self.weight = weight
+        self.quantity = quantity
+
+
+class PlaceOrderRequest:
+    __slots__ = ("name", "address", "contact", "items")
+
+    def __init__(self, name, address, contact, items):
+        self.name = name
+        self.address = address
+        self.contact = contact
+        self.items = items  # list of LineItem
+
+
+class ModifyOrderRequest:
+    # blank customer details are kept, items maps the index of a cake line to its new LineItem
+    __slots__ = ("order_id", "name", "address", "contact", "items")
+
+    def __init__(self, order_id, name="", address="", contact="", items=None):
+        self.order_id = order_id
+        self.name = name
+        self.address = address
+        self.contact = contact
+        self.items = items if items is not None else {}
+
+
+class OrderService:
+    # the order operations without any console input/output, the console UI and the batch mode both use it
+    def __init__(self, backend="avl", id_allocator=None, store=None, thread_safe=False):
+        self.store = store  # OrderStore to keep the orders on disk, None to keep them only in memory
+        tree_class = LockedOrderBST if thread_safe else OrderBST  # LockedOrderBST can be shared by threads
+        if store is not None:
+            self.bst = store.load(backend, tree_class)
+        else:
+            self.bst = tree_class(backend=backend)  # AVL keeps the tree balanced even when the order IDs come in order
+        # random-looking order IDs between 100 and 10000 by default, each allocation is O(1)
+        self.id_allocator = id_allocator if id_allocator is not None else ShuffledIdAllocator(100, 10000)
+        self.catalog = CakeCatalog(self.available_cake_list())  # build the cake catalog once at startup
+        if store is not None:
+            for cake in store.changed_cakes.values():  # cakes added or repriced in earlier runs
+                self.catalog.add_cake(cake)
+        self.customers = CustomerRegistry()
+        for order in self.bst.iter_orders():  # customers and order IDs of the orders loaded from the store
+            self.customers.add_customer(order.customer)
+            self.id_allocator.reserve(order.order_id)
+        self.latency = None  # Metrics of the operation latencies, None until enable_metrics() is called
+
+    def enable_metrics(self):
+        # record the latency of every operation and the tree visits. The methods of this object are replaced by
+        # timed versions, nothing is measured (or slowed down) before this call
+        if self.latency is not None:
+            return
+        self.latency = Metrics(LATENCY_BUCKETS)
+        for operation in ("create_order", "update_order", "remove_order", "find_order", "import_orders"):
+            setattr(self, operation, self.latency.timed(operation, getattr(self, operation)))
+        self.bst.enable_metrics()
+
+    def stats(self):
+        stats = {"tree": self.bst.stats(), "customers": len(self.customers)}
+        if self.store is not None:
+            stats["store_load_seconds"] = self.store.last_load_seconds
+        if self.latency is not None:
+            stats["latency_seconds"] = self.latency.stats()
+        return stats
+
+    def prometheus_metrics(self):
+        # the stats in the Prometheus text exposition format
+        tree = self.bst.stats()
+        lines = ["# TYPE cake_orders gauge", f"cake_orders {tree['orders']}",
+                 "# TYPE cake_customers gauge", f"cake_customers {len(self.customers)}",
+                 "# TYPE cake_order_tree_height gauge", f"cake_order_tree_height {tree['height']}",
+                 "# TYPE cake_order_tree_rotations_total counter",
+                 f"cake_order_tree_rotations_total {tree['rotations']}",
+                 "# TYPE cake_order_revenue gauge", f"cake_order_revenue {tree['total_revenue']}"]
+        if self.store is not None:
+            lines += ["# TYPE cake_order_store_load_seconds gauge",
+                      f"cake_order_store_load_seconds {self.store.last_load_seconds}"]
+        if self.bst.visits is not None:
+            lines += self.bst.visits.prometheus("cake_order_tree_visits")
+        if self.latency is not None:
+            lines += self.latency.prometheus("cake_order_operation_seconds")
+        return "\n".join(lines) + "\n"
+
+    def generate_order_id(self):
+        while True:
+            order_id = self.id_allocator.allocate()  # the allocator never hands out the same ID twice
+            # the IDs of the loaded and imported orders are reserved in the allocator, this only skips an ID used
+            # by an order that was put into the tree some other way
+            if self.bst.search_order(order_id) is None:
+                return order_id
+
+    @staticmethod
+    def available_cake_list():
+        # Create cake objects for the cake catalog
+        cake1 = Cake("1", "Belgium Chocolate Cheesecake", 1.0, 115.00)
+        cake2 = Cake("2", "Burnt Cheesecake", 1.0, 95.00)
+        cake3 = Cake("3", "Strawberry Shortcake", 1.0, 120.00)
+        cake4 = Cake("4", "French Earl Grey", 1.0, 98.50)
+        cake5 = Cake("5", "Lemon Tart", 1.0, 100.50)
+        cake6 = Cake("6", "Lemon Poppy Seed", 1.0, 97.80)
+        cake7 = Cake("7", "Black Forest", 1.0, 96.70)
+        cake8 = Cake("8", "White Forest", 1.0, 96.70)
+        cake9 = Cake("9", "Matchamisu", 1.0, 130.00)
+        cake10 = Cake("10", "Tiramisu (contain alcohol)", 1.0, 135.00)
+        cake11 = Cake("11", "Red Velvet", 1.0, 89.00)
+        cake12 = Cake("12", "Blueberry Cheesecake", 1.0, 128.50)
+
+        return [cake1, cake2, cake3, cake4, cake5, cake6, cake7, cake8, cake9, cake10, cake11, cake12]
+
+    def get_cake_info(self, cake_code):
+        # to get the cake details for specific cake code (use in modify cake order)
+        cake = self.catalog.get_cake(cake_code)
+        if cake is None:
+            return None
+        return cake.flavour, cake.unit_price
+
+    def update_customer(self, customer, name="", address="", contact=""):
+        # change the details of a customer (blank = keep), they are shared by all the orders of the customer
+        # return False if the contact number could not be changed because another customer has it
+        customer_orders = self.bst.customer_orders(customer)
+        contact_changed = True
+        if contact and contact != customer.contact_number:
+            contact_changed = self.customers.change_contact(customer, contact)
+        if name:
+            customer.name = name
+        if address:
+            customer.address = address
+        for order in customer_orders:  # keep the customer indexes up to date
+            self.bst.reindex_order(order)
+        return contact_changed
+
+    def _writing(self):
+        # hold the write lock of a LockedOrderBST while changing orders, nothing to lock for a plain OrderBST
+        if isinstance(self.bst, LockedOrderBST):
+            return self.bst.lock.write()
+        return contextlib.nullcontext()
+
+    def _cake_line(self, item):
+        # check a LineItem and return the (cake, weight, quantity) line for the order
+        if not isinstance(item.cake_code, str):
+            raise ValueError(f"Invalid cake code {item.cake_code!r}.")
+        cake = self.catalog.get_cake(item.cake_code)
+        if cake is None:
+            raise ValueError(f"Invalid cake code '{item.cake_code}'.")
+        if item.weight not in AVAILABLE_WEIGHTS:
+            raise ValueError(f"Invalid weight {item.weight}. Available weights: {AVAILABLE_WEIGHTS}.")
+        if not isinstance(item.quantity, int) or isinstance(item.quantity, bool) or item.quantity <= 0:
+            raise ValueError(f"Invalid quantity {item.quantity}. The quantity must be a positive integer.")
+        return cake, float(item.weight), item.quantity
+
+    @staticmethod
+    def _check_customer_fields(request):
+        # the name, address and contact number must be text, anything else would fail half way through a change
+        for field in ("name", "address", "contact"):
+            if not isinstance(getattr(request, field), str):
+                raise ValueError(f"The customer {field} must be text, not {getattr(request, field)!r}.")
+
+    @staticmethod
+    def _check_contact(contact):
+        if not CONTACT_PATTERN.match(contact):
+            raise ValueError("Invalid contact number. Contact number must start with '0' and have 10-11 digits.")
+
+    def find_order(self, order_id):
+        return self.bst.search_order(order_id)
+
+    def create_order(self, request):
+        # place a new order, raise ValueError if the request is not valid
+        self._check_customer_fields(request)  # every check is done before anything is changed
+        if not request.name or not request.address:
+            raise ValueError("Customer details cannot be empty.")
+        self._check_contact(request.contact)
+        if not request.items:
+            raise ValueError("The order must have at least one cake.")
+        cake_lines = [self._cake_line(item) for item in request.items]
+        with self._writing():
+            # a repeat customer reuses the existing record, with the latest details
+            customer = self.customers.get_customer(request.name, request.address, request.contact)
+            if customer.name != request.name or customer.address != request.address:
+                self.update_customer(customer, request.name, request.address)
+            order = Order(customer)
+            order.set_order_id(self.generate_order_id())
+            for cake, weight, quantity in cake_lines:
+                order.add_cake(cake, weight, quantity)
+            self.bst.insert_order(order)
+            if self.store is not None:
+                self.store.log_insert(order)
+        return order
+
+    def update_order(self, request):
+        # modify an order, nothing is changed if the request is not valid (ValueError)
+        self._check_customer_fields(request)
+        if request.contact:
+            self._check_contact(request.contact)
+        with self._writing():  # the order is looked up under the lock, so it cannot be deleted before it is changed
+            order = self.bst.search_order(request.order_id)
+            if order is None:
+                raise OrderNotFoundError(f"Order {request.order_id} not found.")
+            if request.contact:
+                other = self.customers.find_customer(request.contact)
+                if other is not None and other is not order.customer:
+                    raise ValueError("This contact number belongs to another customer.")
+            cake_lines = {}
+            for index, item in request.items.items():
+                if not 0 <= index < len(order.cake_items):
+                    raise ValueError(f"Order {request.order_id} has no cake item {index + 1}.")
+                cake_lines[index] = self._cake_line(item)
+            self.update_customer(order.customer, request.name, request.address, request.contact)
+            for index, (cake, weight, quantity) in cake_lines.items():
+                order.set_cake_item(index, cake, weight, quantity)  # the total amount is updated as well
+            self.bst.reindex_order(order)  # keep the customer and cake indexes up to date
+            if self.store is not None:
+                self.store.log_modify(order)
+        return order
+
+    def change_cake(self, cake):
+        # add a cake to the catalog or replace the one with the same code (e.g. a new price). The open orders with
+        # that cake code get the new record and their totals are added up again, return the orders that changed
+        with self._writing():
+            self.catalog.add_cake(cake)
+            if self.store is not None:
+                self.store.log_cake(cake)
+            orders = self.bst.orders_by_cake(cake.code)
+            for order in orders:
+                order.cake_items = [(cake if old_cake.code == cake.code else old_cake, weight, quantity)
+                                    for old_cake, weight, quantity in order.cake_items]
+                order.invalidate_total_amount()  # also updates the revenue of the tree and the analytics
+                if self.store is not None:
+                    self.store.log_modify(order)
+        return orders
+
+    def remove_order(self, order_id):
+        # delete an order and return it, raise ValueError if there is no such order
+        with self._writing():
+            order = self.bst.search_order(order_id)
+            if order is None:
+                raise OrderNotFoundError(f"Order {order_id} not found.")
+            self.bst.delete_order(order_id)
+            self.id_allocator.release(order_id)  # the order ID can be used again
+            if self.store is not None:
+                self.store.log_delete(order_id)
+        return order
+
+    def apply_operations(self, operations):
+        # apply ("place" | "modify" | "delete", request) pairs with one lock acquisition for all of them
+        # return a (result, error) pair for each operation, a failed operation (whatever the error) does not stop
+        # the others or lose their results
+        handlers = {"place": self.create_order, "modify": self.update_order, "delete": self.remove_order}
+        results = []
+        with self._writing():
+            for op, request in operations:
+                try:
+                    results.append((handlers[op](request), None))
+                except Exception as error:
+                    results.append((None, error))
+        return results
+
+    def remove_orders(self, order_ids):
+        # delete a batch of orders (e.g. an end-of-day cleanup) and return them, order IDs that are not there are
+        # skipped
+        with self._writing():
+            removed = self.bst.delete_many(order_ids)
+            for order in removed:
+                self.id_allocator.release(order.order_id)
+                if self.store is not None:
+                    self.store.log_delete(order.order_id)
+        return removed
+
+    def import_orders(self, lines, file_format="jsonl"):
+        # stream orders from an export file into the tree, return the number of orders imported
+        with self._writing():
+            imported = import_orders(self.bst, lines, file_format)
+            for order in self.bst.iter_orders():  # register the customers and order IDs of the imported orders
+                self.customers.add_customer(order.customer)
+                self.id_allocator.reserve(order.order_id)
+            if self.store is not None:
+                self.store.snapshot()  # one snapshot instead of logging every imported order
+        return imported
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()  # make sure every logged operation is on disk
+
+
+class CakeOrderingSystem(OrderService):
+    # console UI of the ordering system
+    order_page_size = 20  # orders per page in "View All Orders"
+
+    def __init__(self, backend="avl", id_allocator=None, store=None, thread_safe=False):
+        super().__init__(backend, id_allocator, store, thread_safe)
+        self.cake_table = None  # the rendered cake menu, drawn again only when the catalog changes
+        self.cake_table_version = None
 
     @staticmethod
     def display_menu():
@@ -213,45 +1565,21 @@ class CakeOrderingSystem:
         print("6. Delete an Order")
         print("7. Exit")
 
-    def generate_order_id(self):
-        while True:
-            order_id = random.randint(100, 10000)
-            if not self.bst.search_order(order_id):  # so that the order ID does not duplicate
-                return order_id
-
-    def available_cake_list(self):
-        # Create cake objects and add them to the cake list
-        cake1 = ["1", "Belgium Chocolate Cheesecake", 1.0, 115.00]
-        cake2 = ["2", "Burnt Cheesecake", 1.0, 95.00]
-        cake3 = ["3", "Strawberry Shortcake", 1.0, 120.00]
-        cake4 = ["4", "French Earl Grey", 1.0, 98.50]
-        cake5 = ["5", "Lemon Tart", 1.0, 100.50]
-        cake6 = ["6", "Lemon Poppy Seed", 1.0, 97.80]
-        cake7 = ["7", "Black Forest", 1.0, 96.70]
-        cake8 = ["8", "White Forest", 1.0, 96.70]
-        cake9 = ["9", "Matchamisu", 1.0, 130.00]
-        cake10 = ["10", "Tiramisu (contain alcohol)", 1.0, 135.00]
-        cake11 = ["11", "Red Velvet", 1.0, 89.00]
-        cake12 = ["12", "Blueberry Cheesecake", 1.0, 128.50]
-
-        self.cake_lists = [cake1, cake2, cake3, cake4, cake5, cake6, cake7, cake8, cake9, cake10, cake11, cake12]
-
     def view_cake_list(self):
         # print the cake lists in table
-        # print("")
-        self.available_cake_list()
-        headers = ["Cake Code", "Flavour", "Weight (kg)", "Unit Price (RM/kg)"]
-        table = tabulate(self.cake_lists, headers=headers, tablefmt="grid")
-        print(table)
+        if self.cake_table_version != self.catalog.version:
+            headers = ["Cake Code", "Flavour", "Weight (kg)", "Unit Price (RM/kg)"]
+            rows = [[cake.code, cake.flavour, cake.weight, cake.unit_price] for cake in self.catalog]
+            self.cake_table = render_table(rows, headers)
+            self.cake_table_version = self.catalog.version
+        print(self.cake_table)
 
-    def get_cake_info(self, cake_code):
-        # to get the cake details for specific cake code (use in modify cake order)
-        for cake in self.cake_lists:
-            if cake[0] == cake_code:
-                flavour = cake[1]
-                unit_price = cake[3]
-                return flavour, unit_price
-        return None
+    @staticmethod
+    def order_table(orders):
+        # table of the order IDs, customer names and total amounts of some orders (e.g. one page)
+        headers = ["Order ID", "Customer Name", "Total Amount (RM)"]
+        rows = [[order.order_id, order.customer.name, f"{order.calculate_total_amount():.2f}"] for order in orders]
+        return render_table(rows, headers, disable_numparse=True)
 
     def place_order(self):
         print("\n~~~~~ Place an Order ~~~~~")
@@ -270,18 +1598,12 @@ class CakeOrderingSystem:
             customer_contact = input("Contact number: ")
 
             # Validate contact number format
-            if not re.match(r'^0\d{9,10}$', customer_contact):
+            if not CONTACT_PATTERN.match(customer_contact):
                 print("Invalid contact number. Please try again. "
                       "Contact number must start with '0' and have 10-11 digits.")
                 customer_contact = None
 
-        # create an object called new_customer for Customer class and pass the user input attributes to the class
-        new_customer = Customer(customer_name, customer_address, customer_contact)
-        # create new_order object and pass it into Order class
-        new_order = Order(new_customer)
-
-        new_order.set_order_id(self.generate_order_id())  # set the order id using random generated id
-        # by calling the set_order_id function in the Order class
+        items = []  # the cakes of the order
 
         print("")
         self.view_cake_list()  # display the cake lists
@@ -289,11 +1611,7 @@ class CakeOrderingSystem:
 
         while True:
             cake_code = input("\nEnter Cake Code: ")
-            cake = None  # initialise the cake to None
-            for c in self.cake_lists:
-                if c[0] == cake_code:  # the cake code entered is exists
-                    cake = Cake(c[0], c[1], c[2], c[3])  # create an object cake and pass it into the Cake class
-                    break
+            cake = self.catalog.get_cake(cake_code)  # shared cake record, None if the cake code does not exist
 
             if cake is None:  # not selecting any cake or invalid cake code
                 print("Invalid Cake Code. Please try again.")
@@ -304,7 +1622,7 @@ class CakeOrderingSystem:
             while weight is None:
                 try:
                     weight = float(input("Enter Weight (in kg): "))
-                    if weight not in [0.25, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0]:
+                    if weight not in AVAILABLE_WEIGHTS:
                         raise ValueError
                 except ValueError:
                     print("Invalid Weight. Please enter a valid weight from the options.\n")
@@ -320,27 +1638,52 @@ class CakeOrderingSystem:
                     print("Invalid Quantity. Please enter a positive integer.")
                     quantity = None
 
-            new_order.add_cake(cake, weight, quantity)  # add the cake into the list that declare in the Order class
+            items.append(LineItem(cake_code, weight, quantity))  # add the cake into the order request
 
             choice = input("\nDo you want to add another cake? (Press 'y' if yes): ")
             if choice.lower() != "y":  # any input beside of y will exit the loop to add multiple cake
                 break
 
-        # Calculate and display total amount
-        total_amount = new_order.calculate_total_amount()
-        print(f"Total Amount: RM {total_amount:.2f}")
+        # Create the order (with a new order ID) and insert it to BST
+        try:
+            new_order = self.create_order(PlaceOrderRequest(customer_name, customer_address, customer_contact, items))
+        except (ValueError, RuntimeError) as error:  # e.g. no more order IDs
+            print(f"The order could not be placed: {error}")
+            input("\nPress Enter to continue...")
+            return
 
-        # Insert order to BST
-        self.bst.insert_order(new_order)
+        # Display total amount
+        print(f"Total Amount: RM {new_order.calculate_total_amount():.2f}")
         print("Order Placed Successfully!\n")
-        self.bst.view_orders_details(self.bst.root, new_order)
+        self.bst.render_order(new_order)
         input("\nPress Enter to continue...")
 
     def view_all_ordersID(self):
-        # display all orders in BST
+        # display the orders in BST one page at a time
         print("\n~~~~~ All Orders ~~~~~")
-        self.bst.display_all_order_ids()
-        input("\nPress Enter to continue...")
+        order_count = len(self.bst)
+        if order_count == 0:  # if the BST is empty
+            print("There are no orders.")
+            input("\nPress Enter to continue...")
+            return
+
+        page_count = (order_count + self.order_page_size - 1) // self.order_page_size
+        page = 1
+        while True:
+            print(self.order_table(self.bst.get_page(page, self.order_page_size)))  # only this page is walked
+            print(f"Page {page} of {page_count} ({order_count} orders)")
+            choice = input("Press 'n' for next page, 'p' for previous page, 'a' to list all orders, "
+                           "or Enter to go back: ").lower()
+            if choice == "n" and page < page_count:
+                page += 1
+            elif choice == "p" and page > 1:
+                page -= 1
+            elif choice == "a":
+                self.bst.display_all_order_ids()  # buffered listing of every order
+                input("\nPress Enter to continue...")
+                return
+            elif choice not in ("n", "p"):
+                return
 
     def view_order_details(self):
         # display selected order in the BST
@@ -366,7 +1709,7 @@ class CakeOrderingSystem:
             order = self.bst.search_order(order_id)
             if order is not None:
                 # Order found
-                self.bst.view_orders_details(self.bst.root, order)  # print order details
+                self.bst.render_order(order)  # print order details
                 break
             else:
                 print("Order not found. Please try again.")
@@ -396,7 +1739,7 @@ class CakeOrderingSystem:
             # Search the order in BST
             order = self.bst.search_order(order_id)
             if order is not None:  # Order found
-                self.bst.view_orders_details(self.bst.root, order)  # print order details
+                self.bst.render_order(order)  # print order details
 
                 # Prompt the user for the new details
                 print("\n--- Modify Customer's Details ---")
@@ -405,17 +1748,11 @@ class CakeOrderingSystem:
                 new_contact = input("Enter new customer contact number (leave blank to keep current): ")
 
                 if new_contact != "":
-                    while not re.match(r'^0\d{9,10}$', new_contact):
+                    while not CONTACT_PATTERN.match(new_contact):
                         print("Invalid contact number. Please try again. "
                               "Contact number must start with '0' and have 10-11 digits.")
                         new_contact = input("\nEnter new customer contact number (leave blank to keep current): ")
-                    order.customer.contact_number = new_contact
-
-                # Update the customer details
-                if new_name != "":
-                    order.customer.name = new_name
-                if new_address != "":
-                    order.customer.address = new_address
+                request = ModifyOrderRequest(order_id, new_name, new_address, new_contact)
 
                 # Update cake items
                 choice = input("\nDo you want to modify the cake items? (Press 'y' if yes): ")
@@ -427,13 +1764,10 @@ class CakeOrderingSystem:
                         while True:
                             new_cake_code = input("Enter New Cake Code (Press Enter to keep current): ")
                             if new_cake_code:  # if the new cake code enter
-                                # Get the flavour and unit price based on the cake code
-                                cake_info = self.get_cake_info(new_cake_code)
-                                if cake_info:  # based on the cake info for that cake code update the cake details
-                                    flavour, unit_price = cake_info
-                                    cake.code = new_cake_code
-                                    cake.flavour = flavour
-                                    cake.unit_price = unit_price
+                                # Get the cake record based on the cake code
+                                new_cake = self.catalog.get_cake(new_cake_code)
+                                if new_cake is not None:  # switch the order line to the new cake
+                                    cake = new_cake
                                     print("\nCake details updated!")
                                     break  # Exit the while loop
                                 else:
@@ -477,15 +1811,17 @@ class CakeOrderingSystem:
                                 print("The current quantity is remain unchanged.\n")
                                 break
 
-                        # update the cake details for the order in the list
-                        order.cake_items[i] = (cake, weight, quantity)
-
-                # Recalculate total amount
-                order.calculate_total_amount()
+                        # update the cake details for the order in the request
+                        request.items[i] = LineItem(cake.code, weight, quantity)
 
+                try:  # update the customer details (blank values keep the current details) and the cakes
+                    self.update_order(request)
+                except ValueError as error:
+                    print(f"{error} The order is not modified.")
+                    break
                 print("Order Modified Successfully!")
                 print(f"\nUpdated Order Details for Order ID {order_id}:")
-                self.bst.view_orders_details(self.bst.root, order)
+                self.bst.render_order(order)
                 break
             else:
                 print("Order not found. Please try again.")
@@ -515,10 +1851,10 @@ class CakeOrderingSystem:
             order = self.bst.search_order(order_id)
             if order is not None:
                 # Order found
-                self.bst.view_orders_details(self.bst.root, order)  # print order details
+                self.bst.render_order(order)  # print order details
                 confirm = input("Are you sure want to delete this order? (Press 'y' if yes): ")
                 if confirm.lower() == "y":
-                    self.bst.delete_order(order_id)
+                    self.remove_order(order_id)
                     print("\nOrder Deleted Successfully!")
                     break
                 else:
@@ -547,15 +1883,241 @@ class CakeOrderingSystem:
             elif choice == "6":
                 self.delete_order()
             elif choice == "7":
+                self.close()
                 print("Exiting the program...  ┏(＾0＾)┛ Bye~Bye~")
                 break
             else:
                 print("Invalid choice. Please try again.\n")
 
 
-# Create and run the Cake Ordering System
-system = CakeOrderingSystem()
-system.run()
+def render_table(rows, headers, **options):
+    # tabulate is imported the first time a table is drawn, not when this module is imported (it takes most
+    # of the import time), so the batch mode, the server and other modules using the classes do not pay for it
+    from tabulate import tabulate
+    return tabulate(rows, headers=headers, tablefmt="grid", **options)
+
+
+def request_from_record(record):
+    # turn one batch record (dict from a JSONL line or a CSV row) into (operation, request)
+    # every field is converted to its type, a missing field or a value that cannot be converted raises ValueError
+    try:
+        op = record["op"]
+        if op == "place":
+            items = [line_item_from_record(item) for item in record["items"]]
+            return op, PlaceOrderRequest(str(record["name"]), str(record["address"]), str(record["contact"]), items)
+        if op == "modify":
+            items = {int(index): line_item_from_record(item) for index, item in record.get("items", {}).items()}
+            return op, ModifyOrderRequest(int(record["order_id"]), str(record.get("name", "")),
+                                          str(record.get("address", "")), str(record.get("contact", "")), items)
+        if op == "delete":
+            return op, int(record["order_id"])
+    except (KeyError, TypeError, AttributeError) as error:
+        raise ValueError(f"Invalid record: {error!r}") from error
+    raise ValueError(f"Unknown operation '{op}'.")
+
+
+def line_item_from_record(item):
+    return LineItem(str(item["cake_code"]), float(item["weight"]), int(item["quantity"]))
+
+
+def read_batch(lines, file_format):
+    # (line number, entry) pairs of a batch file: JSONL lines, or CSV rows with the columns
+    # op,order_id,name,address,contact,items where items is "cake_code:weight:quantity" separated by ";"
+    # (for modify, the cake lines from the first one). The entries are turned into records by batch_record(),
+    # so a bad line only fails that record
+    if file_format == "jsonl":
+        for line_number, line in enumerate(lines, 1):
+            if line.strip():
+                yield line_number, line
+        return
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def batch_record(entry, file_format):
+    # the batch record of one entry from read_batch(), raise ValueError/KeyError if it cannot be read
+    if file_format == "jsonl":
+        return json.loads(entry)  # json.JSONDecodeError is a ValueError
+    items = [dict(zip(("cake_code", "weight", "quantity"), item.split(":")))
+             for item in (entry.get("items") or "").split(";") if item]
+    record = {key: value for key, value in entry.items() if key != "items" and value}
+    record["items"] = items if entry["op"] == "place" else dict(enumerate(items))
+    return record
+
+
+def run_batch(service, entries, file_format="jsonl"):
+    # apply the read_batch() entries to the service as fast as possible, return (applied, failed, seconds)
+    # a line that cannot be read counts as failed like an invalid request, the run goes on with the next line
+    handlers = {"place": service.create_order, "modify": service.update_order, "delete": service.remove_order}
+    applied = failed = 0
+    start = time.perf_counter()
+    for line_number, entry in entries:
+        try:
+            op, request = request_from_record(batch_record(entry, file_format))
+            handlers[op](request)
+            applied += 1
+        except (KeyError, TypeError, ValueError, RuntimeError) as error:
+            failed += 1
+            print(f"Line {line_number}: {error!r}", file=sys.stderr)
+    return applied, failed, time.perf_counter() - start
+
+
+EXPORT_ORDER_COLUMNS = ["order_id", "customer_id", "name", "address", "contact", "total_amount", "items"]
+EXPORT_ITEM_COLUMNS = ["order_id", "customer_id", "name", "address", "contact", "cake_code", "flavour", "cake_weight",
+                       "unit_price", "weight", "quantity"]
+
+
+def export_orders(orders, output, file_format="jsonl", rows="order", buffer_rows=1000):
+    # write the orders (e.g. bst.iter_orders(), in order ID order) to a text file one by one, return the number
+    # of orders written. rows="order" writes one row per order, rows="item" one row per cake line.
+    # rows are written buffer_rows at a time so the memory use stays the same for any number of orders
+    if file_format == "csv":
+        writer = csv.writer(output)
+        writer.writerow(EXPORT_ORDER_COLUMNS if rows == "order" else EXPORT_ITEM_COLUMNS)
+        write_rows = writer.writerows
+    else:
+        def write_rows(buffered):
+            output.write("".join(json.dumps(row) + "\n" for row in buffered))
+    buffered = []
+    exported = 0
+    for order in orders:
+        record = OrderStore.order_to_record(order)
+        if rows == "order":
+            if file_format == "csv":
+                customer_id, name, address, contact = record["customer"]
+                buffered.append([order.order_id, customer_id, name, address, contact, f"{order.total_amount:.2f}",
+                                 json.dumps(record["items"])])
+            else:
+                record["total_amount"] = round(order.total_amount, 2)
+                buffered.append(record)
+        else:
+            for item in record["items"]:
+                row = [order.order_id] + record["customer"] + item
+                buffered.append(row if file_format == "csv" else dict(zip(EXPORT_ITEM_COLUMNS, row)))
+        exported += 1
+        if len(buffered) >= buffer_rows:
+            write_rows(buffered)
+            buffered = []
+    write_rows(buffered)
+    return exported
+
+
+def read_export(lines, file_format="jsonl"):
+    # generator turning the rows of an export file (either kind of rows) back into order records
+    if file_format == "csv":
+        rows = csv.DictReader(lines)
+    else:
+        rows = (json.loads(line) for line in lines if line.strip())
+    record = None
+    for row in rows:
+        if "items" in row:  # one row per order
+            items = row["items"]
+            if file_format == "csv":
+                items = json.loads(items)
+                row["customer"] = [int(row["customer_id"]), row["name"], row["address"], row["contact"]]
+            yield {"order_id": int(row["order_id"]), "customer": row["customer"], "items": items}
+            continue
+        # one row per cake line, the lines of an order are next to each other
+        item = [row["cake_code"], row["flavour"], float(row["cake_weight"]), float(row["unit_price"]),
+                float(row["weight"]), int(row["quantity"])]
+        order_id = int(row["order_id"])
+        if record is not None and record["order_id"] == order_id:
+            record["items"].append(item)
+            continue
+        if record is not None:
+            yield record
+        record = {"order_id": order_id, "customer": [int(row["customer_id"]), row["name"], row["address"],
+                                                     row["contact"]], "items": [item]}
+    if record is not None:
+        yield record
+
+
+def import_orders(bst, lines, file_format="jsonl"):
+    # insert the orders of an export file into the tree one at a time, return the number of orders inserted
+    # (an order whose ID is already in the tree is skipped)
+    cakes = {}  # share the Cake and Customer records like OrderStore.load() does
+    customers = {}
+    count = len(bst)
+    for record in read_export(lines, file_format):
+        bst.insert_order(OrderStore.order_from_record(record, cakes, customers))
+    Customer.skip_ids(customers)  # new customers get IDs after the imported ones
+    return len(bst) - count
+
+
+def print_load_time(service):
+    # the startup time of the orders kept on disk, on stderr so that an export to stdout stays clean
+    if service.store is not None:
+        print(f"Loaded {len(service.bst)} orders from {service.store.directory} in "
+              f"{service.store.last_load_seconds:.3f} s", file=sys.stderr)
+
+
+def main(argv=None):
+    import argparse  # only the command line needs it
+    parser = argparse.ArgumentParser(description="Le Grande Cake Ordering System")
+    parser.add_argument("--backend", choices=OrderBST.backends, default="avl", help="order tree backend")
+    parser.add_argument("--ids", choices=("shuffled", "sequential", "snowflake"), default="shuffled",
+                        help="how new order IDs are allocated")
+    parser.add_argument("--data-dir", help="keep the orders on disk in this directory")
+    parser.add_argument("--batch", metavar="FILE", help="apply the operations in a JSONL/CSV file ('-' = stdin) "
+                                                        "instead of starting the menu")
+    parser.add_argument("--export", metavar="FILE", help="write all orders to a JSONL/CSV file ('-' = stdout)")
+    parser.add_argument("--import", dest="import_file", metavar="FILE", help="read orders from a JSONL/CSV export file")
+    parser.add_argument("--rows", choices=("order", "item"), default="order",
+                        help="export one row per order or one row per cake item")
+    parser.add_argument("--metrics", action="store_true",
+                        help="measure the operations and print the metrics (Prometheus text format) at the end")
+    parser.add_argument("--format", choices=("jsonl", "csv"),
+                        help="batch/export/import file format (default: from the extension)")
+    args = parser.parse_args(argv)
+
+    id_allocators = {"shuffled": ShuffledIdAllocator, "sequential": SequentialIdAllocator,
+                     "snowflake": SnowflakeIdAllocator}
+    store = OrderStore(args.data_dir) if args.data_dir else None
+    if args.batch is None and args.export is None and args.import_file is None:
+        # Create and run the Cake Ordering System
+        system = CakeOrderingSystem(args.backend, id_allocators[args.ids](), store)
+        print_load_time(system)
+        system.run()
+        return
+
+    service = OrderService(args.backend, id_allocators[args.ids](), store)
+    print_load_time(service)
+    if args.metrics:
+        service.enable_metrics()
+    try:
+        if args.import_file is not None:
+            file_format = args.format or ("csv" if args.import_file.endswith(".csv") else "jsonl")
+            with open(args.import_file, encoding="utf-8", newline="") as import_file:
+                start = time.perf_counter()
+                imported = service.import_orders(import_file, file_format)
+            print(f"Imported {imported} orders in {time.perf_counter() - start:.3f} s")
+        if args.batch is not None:
+            file_format = args.format or ("csv" if args.batch.endswith(".csv") else "jsonl")
+            batch_file = sys.stdin if args.batch == "-" else open(args.batch, encoding="utf-8", newline="")
+            try:
+                applied, failed, seconds = run_batch(service, read_batch(batch_file, file_format), file_format)
+            finally:
+                if batch_file is not sys.stdin:
+                    batch_file.close()
+            print(f"Applied {applied} operations ({failed} failed) in {seconds:.3f} s "
+                  f"({(applied + failed) / seconds if seconds else 0:.0f} ops/sec)")
+        if args.export is not None:
+            file_format = args.format or ("csv" if args.export.endswith(".csv") else "jsonl")
+            if args.export == "-":
+                export_orders(service.bst.iter_orders_paged(), sys.stdout, file_format, args.rows)
+            else:
+                with open(args.export, "w", encoding="utf-8", newline="") as export_file:
+                    exported = export_orders(service.bst.iter_orders_paged(), export_file, file_format, args.rows)
+                print(f"Exported {exported} orders to {args.export}")
+        if args.metrics:
+            print(service.prometheus_metrics(), end="")
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
 
 """References:
 Bhat, S. (n.d.) Deletion in Binary Search Tree 
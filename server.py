@@ -0,0 +1,285 @@
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from cakeorderingsystem import (OrderBST, OrderNotFoundError, OrderService, OrderStore, SequentialIdAllocator,
+                                ShuffledIdAllocator, SnowflakeIdAllocator, request_from_record)
+
+STATUS_TEXT = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def order_json(order):
+    record = OrderStore.order_to_record(order)
+    record["total_amount"] = order.calculate_total_amount()
+    return record
+
+
+class OrderServer:
+    # HTTP/1.1 JSON API of an OrderService on asyncio streams:
+    #   GET /orders?after=<order ID>&limit=<n>   list the orders in order ID order, one page at a time
+    #   POST /orders                             place an order (body like a "place" batch record)
+    #   GET /orders/<id>                         view an order
+    #   PATCH /orders/<id>                       modify an order (body like a "modify" batch record)
+    #   DELETE /orders/<id>                      delete an order
+    #   GET /metrics                             the service metrics in the Prometheus text format
+    # place/modify/delete requests are queued and applied in batches (everything queued, up to batch_size),
+    # each batch with one lock acquisition, so a burst of orders does not take the lock once per order
+    def __init__(self, service, batch_size=256):
+        self.service = service
+        self.batch_size = batch_size
+        self.writes = None  # asyncio.Queue of (op, request, future), created in start()
+        self.writer_task = None
+        self.server = None
+        self.batches = 0  # number of batches applied and operations in them, to see how well requests batch up
+        self.batched_operations = 0
+
+    async def start(self, host="127.0.0.1", port=8080):
+        # start listening, return the port (pass port=0 to get a free one)
+        self.writes = asyncio.Queue()
+        self.writer_task = asyncio.create_task(self._apply_writes())
+        self.server = await asyncio.start_server(self._serve_client, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        # stop accepting connections and the writer task, the writes still queued fail with a 503 instead of
+        # leaving their handlers waiting
+        self.server.close()
+        self.writer_task.cancel()
+        try:
+            await self.writer_task
+        except asyncio.CancelledError:
+            pass
+        while not self.writes.empty():
+            op, request, future = self.writes.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("The server is shutting down."))
+        await self.server.wait_closed()
+
+    async def _apply_writes(self):
+        while True:
+            batch = [await self.writes.get()]
+            while len(batch) < self.batch_size and not self.writes.empty():
+                batch.append(self.writes.get_nowait())
+            try:
+                results = self.service.apply_operations([(op, request) for op, request, future in batch])
+            except Exception as error:  # the writer task must keep running, every request of the batch gets the error
+                results = [(None, error)] * len(batch)
+            self.batches += 1
+            self.batched_operations += len(batch)
+            for (op, request, future), (result, error) in zip(batch, results):
+                if future.cancelled():  # the client has gone away
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    async def _write(self, op, request):
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((op, request, future))
+        return await future
+
+    async def _serve_client(self, reader, writer):
+        try:
+            while True:
+                request = await read_http_message(reader)
+                if request is None:  # the client closed the connection
+                    break
+                method, target, headers, body = request
+                status, content_type, payload = await self._handle(method, target, body)
+                writer.write(http_response(status, content_type, payload))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):  # ValueError: not an HTTP request
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, method, target, body):
+        # return (status, content type, body) of the response to one request
+        url = urlsplit(target)
+        parts = [part for part in url.path.split("/") if part]
+        try:
+            if parts == ["metrics"] and method == "GET":
+                return 200, "text/plain; version=0.0.4", self.service.prometheus_metrics().encode()
+            if parts == ["orders"]:
+                if method == "GET":
+                    query = parse_qs(url.query)
+                    after = int(query["after"][0]) if "after" in query else None
+                    limit = min(int(query.get("limit", ["100"])[0]), 1000)
+                    if limit < 1:
+                        raise ValueError("limit must be at least 1.")
+                    orders = self.service.bst.page_after(after, limit)
+                    return json_response(200, {"orders": [order_json(order) for order in orders],
+                                               "next": orders[-1].order_id if len(orders) == limit else None})
+                if method == "POST":
+                    record = json.loads(body)
+                    record["op"] = "place"
+                    return json_response(201, order_json(await self._write(*request_from_record(record))))
+            elif len(parts) == 2 and parts[0] == "orders":
+                order_id = int(parts[1])
+                if method == "GET":
+                    order = self.service.find_order(order_id)
+                    if order is None:
+                        raise OrderNotFoundError(f"Order {order_id} not found.")
+                    return json_response(200, order_json(order))
+                if method == "PATCH":
+                    record = json.loads(body) if body else {}
+                    record.update(op="modify", order_id=order_id)
+                    return json_response(200, order_json(await self._write(*request_from_record(record))))
+                if method == "DELETE":
+                    return json_response(200, order_json(await self._write("delete", order_id)))
+            else:
+                return json_response(404, {"error": f"Unknown path {url.path}."})
+            return json_response(405, {"error": f"Method {method} not allowed on {url.path}."})
+        except OrderNotFoundError as error:
+            return json_response(404, {"error": str(error)})
+        except (KeyError, TypeError, ValueError) as error:  # bad JSON, missing fields or invalid values
+            return json_response(400, {"error": str(error) or repr(error)})
+        except RuntimeError as error:  # e.g. no more order IDs
+            return json_response(503, {"error": str(error)})
+        except Exception as error:  # a bug, answer instead of dropping the connection
+            return json_response(500, {"error": repr(error)})
+
+
+def json_response(status, data):
+    return status, "application/json", json.dumps(data).encode()
+
+
+def http_response(status, content_type, payload):
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n\r\n")
+    return head.encode() + payload
+
+
+async def read_http_message(reader):
+    # read one HTTP/1.1 request or response: (start line words, headers, body), None at the end of the stream
+    start_line = await reader.readline()
+    if not start_line:
+        return None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    first, second, *rest = start_line.decode("latin-1").split()
+    return first, second, headers, body
+
+
+class LoadClient:
+    # one keep-alive HTTP connection of the load generator
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, method, path, data=None):
+        body = json.dumps(data).encode() if data is not None else b""
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await self.writer.drain()
+        version, status, headers, payload = await read_http_message(self.reader)
+        return int(status), json.loads(payload)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def load_test(host, port, concurrency, orders_per_client, view_every=4):
+    # concurrency clients each place orders_per_client orders as fast as they can (and view every view_every-th
+    # order they placed), return the throughput and the latency percentiles of the place requests
+    latencies = []
+
+    async def run_client(client_number):
+        client = await LoadClient.connect(host, port)
+        place = {"name": f"Load Client {client_number}", "address": "1 Loopback Road",
+                 "contact": f"01{client_number:08d}", "items": [{"cake_code": "1", "weight": 1.0, "quantity": 1}]}
+        try:
+            for i in range(orders_per_client):
+                start = time.perf_counter()
+                status, order = await client.request("POST", "/orders", place)
+                latencies.append(time.perf_counter() - start)
+                if status != 201:
+                    raise RuntimeError(f"Placing an order failed: {status} {order}")
+                if view_every and i % view_every == 0:
+                    await client.request("GET", f"/orders/{order['order_id']}")
+        finally:
+            await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(number) for number in range(concurrency)))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    count = len(latencies)
+    return {"concurrency": concurrency, "orders": count, "seconds": round(seconds, 3),
+            "orders_per_sec": round(count / seconds, 1),
+            "p50_ms": round(latencies[count // 2] * 1000, 3),
+            "p99_ms": round(latencies[min(count - 1, count * 99 // 100)] * 1000, 3),
+            "max_ms": round(latencies[-1] * 1000, 3)}
+
+
+async def run_load_tests(concurrencies, total_orders, batch_size, backend):
+    # start a server on a free loopback port in this process and run the load generator against it
+    for concurrency in concurrencies:
+        server = OrderServer(OrderService(backend, SequentialIdAllocator()), batch_size)
+        port = await server.start("127.0.0.1", 0)
+        try:
+            result = await load_test("127.0.0.1", port, concurrency, max(1, total_orders // concurrency))
+        finally:
+            await server.close()
+        result["operations_per_batch"] = round(server.batched_operations / server.batches, 2)
+        print(f"concurrency {result['concurrency']:>4}  {result['orders_per_sec']:>9} orders/s  "
+              f"p50 {result['p50_ms']:>8} ms  p99 {result['p99_ms']:>8} ms  max {result['max_ms']:>8} ms  "
+              f"{result['operations_per_batch']:>6} operations/batch")
+
+
+async def serve(service, host, port, batch_size):
+    server = OrderServer(service, batch_size)
+    port = await server.start(host, port)
+    print(f"Serving orders on http://{host}:{port}/orders")
+    await server.server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP order service and its load generator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--backend", choices=OrderBST.backends, default="avl", help="order tree backend")
+    parser.add_argument("--ids", choices=("shuffled", "sequential", "snowflake"), default="shuffled",
+                        help="how new order IDs are allocated")
+    parser.add_argument("--data-dir", help="keep the orders on disk in this directory")
+    parser.add_argument("--batch-size", type=int, default=256, help="most changes applied under one lock")
+    parser.add_argument("--load-test", action="store_true",
+                        help="run the load generator against a server on a loopback port instead of serving")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 64],
+                        help="numbers of concurrent load test clients")
+    parser.add_argument("--orders", type=int, default=5000, help="orders placed per load test run")
+    args = parser.parse_args(argv)
+
+    if args.load_test:
+        asyncio.run(run_load_tests(args.concurrency, args.orders, args.batch_size, args.backend))
+        return
+    id_allocators = {"shuffled": ShuffledIdAllocator, "sequential": SequentialIdAllocator,
+                     "snowflake": SnowflakeIdAllocator}
+    service = OrderService(args.backend, id_allocators[args.ids](), OrderStore(args.data_dir) if args.data_dir else None)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.batch_size))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import argparse
+import bisect
+import heapq
+import multiprocessing
+import random
+import time
+
+from cakeorderingsystem import Customer, Order, OrderBST, OrderService, OrderStore
+
+
+def _shard_worker(connection, backend):
+    # runs in a worker process: keeps one OrderBST partition and answers the requests of the ShardedOrderBST
+    # orders travel as OrderStore records (plain lists and dicts), the worker keeps its own cake and customer records
+    bst = OrderBST(backend=backend)
+    cakes = {}
+    customers = {}
+
+    def insert(records):
+        # return the number of orders inserted, an order ID that is already there is skipped
+        count = len(bst)
+        for record in records:
+            bst.insert_order(OrderStore.order_from_record(record, cakes, customers))
+        return len(bst) - count
+
+    def search(order_ids):
+        orders = [bst.search_order(order_id) for order_id in order_ids]
+        return [OrderStore.order_to_record(order) if order is not None else None for order in orders]
+
+    def delete(order_ids):
+        deleted = 0
+        for order_id in order_ids:
+            if bst.search_order(order_id) is not None:
+                bst.delete_order(order_id)
+                deleted += 1
+        return deleted
+
+    def replace(records):
+        # a modified order replaces the one with the same ID
+        for record in records:
+            bst.delete_order(record["order_id"])
+        return insert(records)
+
+    def page_after(cursor, page_size):
+        return [OrderStore.order_to_record(order) for order in bst.page_after(cursor, page_size)]
+
+    def range_records(low, high):
+        return [OrderStore.order_to_record(order) for order in bst.range(low, high)]
+
+    def totals():
+        return len(bst), bst.total_revenue
+
+    handlers = {"insert": insert, "search": search, "delete": delete, "replace": replace,
+                "page_after": page_after, "range": range_records, "totals": totals, "stats": bst.stats}
+    while True:
+        message = connection.recv()
+        if message is None:  # the front is closing
+            break
+        operation, args = message
+        try:
+            connection.send((True, handlers[operation](*args)))
+        except Exception as error:  # sent back and raised again in the front process
+            connection.send((False, error))
+    connection.close()
+
+
+class ShardedOrderBST:
+    # orders split over several OrderBST partitions, each in its own worker process, so the work runs on several
+    # cores. partition="hash" puts order ID i on shard i % shards, partition="range" puts it on the first shard
+    # whose boundary is bigger than i (boundaries = sorted upper bounds of the first shards - 1 shards)
+    # point operations go only to the shard of the order ID, batches are split by shard and the shards work on
+    # their parts at the same time; listings and totals ask every shard (scatter-gather) and the sorted results
+    # of the shards are merged into order ID order (k-way merge)
+    partitions = ("hash", "range")
+
+    def __init__(self, shards=None, backend="avl", partition="hash", boundaries=None, page_size=1000):
+        if partition not in ShardedOrderBST.partitions:
+            raise ValueError(f"Unknown partition '{partition}'. Choose from: {', '.join(ShardedOrderBST.partitions)}")
+        self.shard_count = shards if shards is not None else multiprocessing.cpu_count()
+        if partition == "range" and (boundaries is None or len(boundaries) != self.shard_count - 1):
+            raise ValueError(f"Range partitioning over {self.shard_count} shards needs {self.shard_count - 1} "
+                             f"boundaries.")
+        self.partition = partition
+        self.boundaries = sorted(boundaries) if boundaries is not None else None
+        self.page_size = page_size  # orders fetched from each shard at a time while merging
+        self.cakes = {}  # cake and customer records of the orders rebuilt in this process
+        self.customers = {}
+        self.connections = []
+        self.processes = []
+        for _ in range(self.shard_count):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_shard_worker, args=(worker_connection, backend), daemon=True)
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def shard_of(self, order_id):
+        if self.partition == "hash":
+            return order_id % self.shard_count
+        return bisect.bisect_right(self.boundaries, order_id)
+
+    def _call(self, shard, operation, *args):
+        self.connections[shard].send((operation, args))
+        return self._result(shard)
+
+    def _result(self, shard):
+        ok, result = self.connections[shard].recv()
+        if not ok:
+            raise result
+        return result
+
+    def _scatter(self, requests):
+        # send {shard: (operation, args)} to the shards, then collect the results, so the shards work in parallel
+        # every reply is read before an error is raised, a reply left in a pipe would be taken as the answer to
+        # the next request to that shard
+        for shard, (operation, args) in requests.items():
+            self.connections[shard].send((operation, args))
+        replies = {shard: self.connections[shard].recv() for shard in requests}
+        for ok, result in replies.values():
+            if not ok:
+                raise result
+        return {shard: result for shard, (ok, result) in replies.items()}
+
+    def _split(self, items, order_id_of):
+        # group items by the shard of their order ID
+        groups = {}
+        for item in items:
+            groups.setdefault(self.shard_of(order_id_of(item)), []).append(item)
+        return groups
+
+    def _order(self, record):
+        return OrderStore.order_from_record(record, self.cakes, self.customers) if record is not None else None
+
+    # point operations, routed to one shard
+    def insert_order(self, order):
+        self._call(self.shard_of(order.order_id), "insert", [OrderStore.order_to_record(order)])
+
+    def search_order(self, order_id):
+        return self._order(self._call(self.shard_of(order_id), "search", [order_id])[0])
+
+    def delete_order(self, order_id):
+        # return True if the order was there
+        return self._call(self.shard_of(order_id), "delete", [order_id]) == 1
+
+    def replace_order(self, order):
+        # store a modified order in place of the one with the same ID
+        self._call(self.shard_of(order.order_id), "replace", [OrderStore.order_to_record(order)])
+
+    # batches, split by shard and done by the shards in parallel
+    def insert_orders(self, orders):
+        groups = self._split((OrderStore.order_to_record(order) for order in orders), lambda record: record["order_id"])
+        return sum(self._scatter({shard: ("insert", (records,)) for shard, records in groups.items()}).values())
+
+    def search_orders(self, order_ids):
+        # the orders (None if not found) in the same order as order_ids
+        order_ids = list(order_ids)
+        groups = self._split(order_ids, lambda order_id: order_id)
+        results = self._scatter({shard: ("search", (ids,)) for shard, ids in groups.items()})
+        found = {}
+        for shard, ids in groups.items():
+            found.update(zip(ids, results[shard]))
+        return [self._order(found[order_id]) for order_id in order_ids]
+
+    def delete_orders(self, order_ids):
+        # return the number of orders deleted, IDs that are not there are skipped
+        groups = self._split(order_ids, lambda order_id: order_id)
+        return sum(self._scatter({shard: ("delete", (ids,)) for shard, ids in groups.items()}).values())
+
+    # scatter-gather over every shard
+    def __len__(self):
+        return sum(count for count, revenue in self._scatter(self._every_shard("totals")).values())
+
+    def total_revenue(self):
+        return sum(revenue for count, revenue in self._scatter(self._every_shard("totals")).values())
+
+    def stats(self):
+        return {"partition": self.partition, "shards": self._scatter(self._every_shard("stats"))}
+
+    def _every_shard(self, operation, *args):
+        return {shard: (operation, args) for shard in range(self.shard_count)}
+
+    def range(self, low, high):
+        # list of the orders with low <= order ID <= high in order
+        results = self._scatter(self._every_shard("range", low, high))
+        records = heapq.merge(*results.values(), key=lambda record: record["order_id"])
+        return [self._order(record) for record in records]
+
+    def iter_orders(self):
+        # every order in order ID order: each shard is read page_size orders at a time and the shards are merged
+        # so only one page per shard is held in memory
+        return (self._order(record) for record in heapq.merge(*(self._iter_shard(shard)
+                                                                  for shard in range(self.shard_count)),
+                                                                key=lambda record: record["order_id"]))
+
+    def _iter_shard(self, shard):
+        cursor = None
+        while True:
+            records = self._call(shard, "page_after", cursor, self.page_size)
+            yield from records
+            if len(records) < self.page_size:
+                return
+            cursor = records[-1]["order_id"]
+
+    def close(self):
+        for connection, process in zip(self.connections, self.processes):
+            connection.send(None)
+            connection.close()
+            process.join()
+        self.connections = []
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def main(argv=None):
+    # throughput of the sharded tree with different numbers of shards
+    parser = argparse.ArgumentParser(description="Throughput of the sharded order tree")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4], help="numbers of shards to compare")
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=10000, help="orders per insert/search batch")
+    parser.add_argument("--partition", choices=ShardedOrderBST.partitions, default="hash")
+    args = parser.parse_args(argv)
+
+    print(f"{multiprocessing.cpu_count()} CPUs")
+    cakes = OrderService.available_cake_list()
+    ids = list(range(1, args.orders + 1))
+    random.Random(1).shuffle(ids)
+    orders = []
+    for order_id in ids:
+        order = Order(Customer("Shard Customer", "1 Shard Road", "0123456789"))
+        order.set_order_id(order_id)
+        order.add_cake(cakes[order_id % len(cakes)], 1.0, 1)
+        orders.append(order)
+    for shard_count in args.shards:
+        boundaries = [args.orders * (i + 1) // shard_count for i in range(shard_count - 1)]
+        with ShardedOrderBST(shard_count, partition=args.partition, boundaries=boundaries) as tree:
+            start = time.perf_counter()
+            for i in range(0, len(orders), args.batch):
+                tree.insert_orders(orders[i:i + args.batch])
+            insert_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            for i in range(0, len(ids), args.batch):
+                tree.search_orders(ids[i:i + args.batch])
+            search_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            listed = sum(1 for _ in tree.iter_orders())
+            merge_seconds = time.perf_counter() - start
+        print(f"{shard_count:>3} shards  insert {args.orders / insert_seconds:>10.0f} orders/s  "
+              f"search {args.orders / search_seconds:>10.0f} orders/s  in-order merge of {listed} orders "
+              f"{merge_seconds:.3f} s")
+
+
+if __name__ == "__main__":
+    main()